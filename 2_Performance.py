@@ -4,6 +4,7 @@ import pandas as pd
 from datetime import datetime
 from utils import (
     create_global_sidebar,
+    get_filtered_df,
     load_digium_kpi,
     chart_calls_by_category,
     generate_performance_pdf,
@@ -17,6 +18,8 @@ from utils import (
     shifts,
     poa_table,
     top_3_talk_times,
+    get_call_kpis,
+    chart_service_level_curve,
 )
 from smc import smc_stats, initialize_smc_poa, top_4_inc
 # --- Page Setup ---
@@ -26,10 +29,10 @@ st.title("Performance Report")
 # Use the global sidebar to get the date range
 create_global_sidebar()
 # --- Data Loading and Validation ---
-if 'df_filtered' not in st.session_state or st.session_state['df_filtered'] is None or st.session_state['df_filtered'].empty:
+df = get_filtered_df()
+if df is None or df.empty:
     st.warning("Please upload and filter data on the Home page to view this report.")
     st.stop()
-df = st.session_state['df_filtered']
 
 # Display the active filters for context
 display_active_filters()
@@ -67,6 +70,9 @@ st.divider()
 # --- Display Report on Page ---
 st.header("Call Center Metrics")
 load_digium_kpi(df) 
+service_level_fig = chart_service_level_curve(get_call_kpis(df).service_level)
+if service_level_fig is not None:
+    st.plotly_chart(service_level_fig, use_container_width=True)
 
 st.divider()
 
@@ -101,5 +107,8 @@ with d4:
     auto_avg_resolution_bar(df)
 '''
 
+st.divider()
+shifts(df)
+
 st.divider()
 smc_stats()
\ No newline at end of file
@@ -4,6 +4,7 @@ import pandas as pd
 import plotly.graph_objects as go
 from utils import (
     create_global_sidebar,
+    get_filtered_df,
     display_active_filters,
     chart_calls_by_category,
     donut_hold_time_breakdown,
@@ -16,6 +17,12 @@ from utils import (
     hold_top3_shift,
     auto_call_hold_time_by_shift,
     dwayne_YTD_top_avg_hold2,
+    get_call_kpis,
+    service_level,
+    answer_threshold_min,
+    ytd_sketch_summary,
+    chart_ytd_hold_percentiles,
+    chart_ytd_unique_callers,
 )
 from smc import (
     pct_resolved_3rd_lvl,
@@ -37,12 +44,11 @@ st.title("Exportable Weekly PDF Summary")
 create_global_sidebar()
 
 # --- Data Validation ---
-if 'df_filtered' not in st.session_state or st.session_state['df_filtered'].empty:
+df = get_filtered_df()
+if df is None or df.empty:
     st.warning("Please upload and filter data on the Home page to view this report.")
     st.stop()
 
-df = st.session_state['df_filtered']
-
 # --- Filter Context ---
 display_active_filters()
 
@@ -85,7 +91,8 @@ c1, c2, c3, c4, c5, c6 = st.columns(6, gap="small")
 comments_list = []
 
 # --- Metric Calculations & Gauge Generation ---
-total_calls = df['Call ID'].nunique()
+kpis = get_call_kpis(df)
+total_calls = kpis.calls
 
 #with c0:
 #   pass
@@ -131,7 +138,7 @@ total_calls = df['Call ID'].nunique()
 
 with c1:
     poa = 2
-    avg_hold_time_min = pd.to_numeric(df['Hold Time (s)'], errors='coerce').mean() / 60
+    avg_hold_time_min = kpis.avg_hold_min
     color = "green" if avg_hold_time_min <= 2 else "red" if avg_hold_time_min <= 3 else "red"
     if color == "red":
         comments_list.append(f"❗ **Avg Hold Time:** Exceeds 2 minutes ({avg_hold_time_min:.1f} min).")
@@ -159,14 +166,15 @@ with c1:
 # C2: Avg Time to Resolution (min)
 with c2:
     poa = 90
-    answered_pct = (df['Hold Time (s)'] < 300).sum() / len(df) * 100
+    threshold_min = answer_threshold_min()
+    answered_pct = float(service_level(kpis.service_level, threshold_min * 60))
     color = "green" if answered_pct >= 90 else "red" if answered_pct >= 80 else "red"
     if color == "red":
-        comments_list.append("❗ **% Answered < 5min:** Less than 80% of calls were answered in under 5 minutes.")
+        comments_list.append(f"❗ **% Answered < {threshold_min:g}min:** Less than 80% of calls were answered in under {threshold_min:g} minutes.")
     fig_answered = go.Figure(go.Indicator(
         mode="gauge+number",
         value=answered_pct,
-        title={"text": "% Answered < 5min- Target > 90 %}", 'font': {'size': 12}},
+        title={"text": f"% Answered < {threshold_min:g}min- Target > 90 %", 'font': {'size': 12}},
         gauge={'axis': {'range': [0, 100]}, 'bar': {'color': color},
             'steps': [{'range': [0, 80], 'color': "grey"},
                         {'range': [80, 90], 'color': "darkgrey"},
@@ -291,6 +299,10 @@ with v1:
     st.metric("Total Automation Calls", len(automation_df))
     dwayne_YTD_avg_hold()
     dwayne_YTD_top_avg_hold()
+    ytd_summary = ytd_sketch_summary()
+    for fig_ytd in (chart_ytd_hold_percentiles(ytd_summary), chart_ytd_unique_callers(ytd_summary)):
+        if fig_ytd is not None:
+            st.plotly_chart(fig_ytd, use_container_width=True)
     #fig_category = chart_calls_by_category(df)
     #st.plotly_chart(fig_category, use_container_width=True)
     #sql_YTD_avg_hold()
@@ -318,7 +330,7 @@ with v3:
 kpi_data = {
     "Total Unique Calls": total_calls,
     "Avg Hold Time (min)": f"{avg_hold_time_min:.2f}",
-    "% Answered < 5min": f"{answered_pct:.2f}%",
+    f"% Answered < {threshold_min:g}min": f"{answered_pct:.2f}%",
     "Avg Time to Resolution (min)": f"{auto_mttr_min:.2f}",
     "% Resolved by 3rd Lvl": f"{pct_resolved_3rd:.2f}%",
     "% Resolved < 7 Days": f"{pct_resolved_7_days:.2f}%",
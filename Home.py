@@ -15,12 +15,41 @@ import streamlit as st
 import pandas as pd 
 from datetime import date 
 from utils import ( 
+    process_uploaded_files, 
     process_uploaded_file, 
+    append_call_data, 
+    update_call_rollups, 
+    chart_weekly_call_volume, 
     load_agent_mapping_from_file, 
+    remap_agent_names,
+    active_agent_map,
     create_global_sidebar, 
     display_active_filters, 
-    
-    REQUIRED_COLUMNS, 
+    get_filtered_df,
+    memory_report,
+    processed_cache_stats,
+    update_segment_table,
+    update_call_table,
+    update_call_cube,
+    build_call_cube,
+    build_call_sketches,
+    automation_wait_pct,
+    answer_threshold_min,
+    ANSWER_THRESHOLD_MIN,
+    merge_call_sketches,
+    store_call_sketches,
+    build_dataset,
+    derive_dataset,
+    register_dataset,
+    get_dataset,
+    dataset_key,
+    upload_cache_key,
+    agent_map_fingerprint,
+    active_call_category_rules,
+    load_call_category_rules,
+    recategorize_calls,
+    CALL_CATEGORY_RULES_PATH,
+    digium_template_csv, 
     # Assuming these functions are in utils.py and accept a dataframe 
     # table_call_data_preview, 
     # bar_v1 
@@ -41,8 +70,8 @@ def initialize_session_state():
     # This function ensures all necessary keys exist in the session state 
     # when the app is first started. 
     defaults = { 
-        'df_original': None, 
-        'df_filtered': None, 
+        'dataset_key': None,
+        'filter_rows': None,
         'agent_map_custom': None, 
         'call_data_uploaded': False, 
         # Using your specified, detailed POA targets from your original file 
@@ -53,6 +82,7 @@ def initialize_session_state():
         'poa_automation_wait': 90.0, 
         'poa_conventional_mttr': 2.0, 
         'poa_automation_mttr': 1.0,
+        'answer_threshold_min': ANSWER_THRESHOLD_MIN,
         'actual_mttr': 1, 
         'actual_tsg_defects': 5,
         'actual_automation_wait': 90,        
@@ -84,10 +114,81 @@ st.divider()
 col_upload, col_settings = st.columns([0.2, 0.8]) 
 with col_upload: 
     st.subheader("1. Upload Data Files") 
-    call_file = st.file_uploader("Upload Digium Call Data", type=["csv"]) 
+    call_files = st.file_uploader("Upload Digium Call Data", type=["csv"], accept_multiple_files=True) 
     
-    if call_file: 
-        st.session_state['df_original'] = process_uploaded_file(call_file) 
+    if call_files: 
+        # Only reload when the set of uploaded files changes, so an appended week isn't overwritten;
+        # the shared registry may already hold these files from another session
+        upload_id = tuple(f.file_id for f in call_files)
+        evicted = st.session_state.get('dataset_key') is not None and get_dataset() is None
+        if st.session_state.get('upload_id') != upload_id or evicted:
+            category_rules = active_call_category_rules()
+            key = dataset_key(
+                *(upload_cache_key(f.getvalue()) for f in call_files),
+                agent_map_fingerprint(active_agent_map()), category_rules['fingerprint'],
+            )
+            if get_dataset(key) is None:
+                progress = st.progress(0.0, text="Reading call data...")
+                df_upload, duplicates_dropped = process_uploaded_files(
+                    call_files, _on_progress=lambda done: progress.progress(done, text=f"Reading call data... {done:.0%}")
+                )
+                progress.empty()
+                if df_upload is not None:
+                    df_upload = recategorize_calls(remap_agent_names(df_upload, active_agent_map()), category_rules)
+                    dataset = register_dataset(key, build_dataset(
+                        df_upload, duplicates_dropped=duplicates_dropped, category_rules=category_rules['fingerprint']
+                    ))
+                    store_call_sketches(dataset['sketches'])
+            st.session_state['dataset_key'] = key if get_dataset(key) is not None else None
+            st.session_state['upload_id'] = upload_id
+            st.session_state['filter_rows'] = None
+        dataset = get_dataset()
+        if dataset is not None and len(call_files) > 1:
+            st.caption(f"Merged {len(call_files)} files; dropped {dataset['duplicates_dropped']:,} duplicate call legs.")
+        parse_report = dataset['df'].attrs.get('parse_report') if dataset is not None else None
+        if parse_report and (parse_report['slow_rows'] or parse_report['dropped_rows']):
+            st.caption(
+                f"{parse_report['slow_rows']:,} rows needed slow Start Time parsing; "
+                f"{parse_report['dropped_rows']:,} rows had an unreadable Start Time and were skipped."
+            )
+    if get_dataset() is not None:
+        new_week = st.file_uploader(
+            "Append New Week of Call Data", type=["csv"],
+            help="Adds only the call legs that aren't already loaded, without reprocessing the loaded history."
+        )
+        if new_week and st.session_state.get('appended_file') != new_week.file_id:
+            df_new = process_uploaded_file(new_week)
+            if df_new is not None:
+                df_new = recategorize_calls(remap_agent_names(df_new, active_agent_map()), active_call_category_rules())
+                dataset = get_dataset()
+                df_appended, df_added, dropped = append_call_data(dataset['df'], df_new)
+                appended = len(df_added)
+                if appended:
+                    # the loaded dataset may be shared, so the appended one is registered as a new dataset
+                    key = dataset_key(st.session_state['dataset_key'], upload_cache_key(new_week.getvalue()))
+                    dataset = register_dataset(key, derive_dataset(
+                        dataset,
+                        df=df_appended,
+                        rollups=update_call_rollups(dataset['rollups'], df_added),
+                        segments=update_segment_table(dataset['segments'], df_added),
+                        calls=update_call_table(dataset['calls'], df_appended, df_added),
+                        cube=update_call_cube(dataset['cube'], df_added),
+                        sketches=merge_call_sketches(dataset['sketches'], build_call_sketches(df_added)),
+                        memory_report=memory_report(df_appended),
+                    ))
+                    store_call_sketches(dataset['sketches'])
+                    st.session_state['dataset_key'] = key
+                    st.session_state['filter_rows'] = None
+                st.session_state['appended_file'] = new_week.file_id
+                st.session_state['append_result'] = (appended, dropped)
+        if new_week and st.session_state.get('append_result'):
+            appended, dropped = st.session_state['append_result']
+            st.caption(f"Appended {appended:,} new call legs; {dropped:,} were already loaded.")
+    cache_stats = processed_cache_stats()
+    st.caption(
+        f"Upload cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"{cache_stats['entries']} files ({cache_stats['size_mb']:.1f} MB)"
+    )
     
 
     with st.expander("Optional Settings"):
@@ -100,13 +201,53 @@ with col_upload:
                 st.session_state['actual_staff_for_week'] = st.session_state['num_shifts']
                 st.success("Staff data saved!")
         ticket_file = st.file_uploader("Upload SMC Ticket Data (Optional)", type=["csv"])
-        template_csv = pd.DataFrame(columns=list(REQUIRED_COLUMNS)).to_csv(index=False).encode('utf-8') 
-        mapping_file = st.file_uploader("Upload Agent-Extension Mapping File (Optional)", type=["xlsx"], accept_multiple_files=False)
-        if mapping_file:
+        st.download_button("Download Call Data Template", digium_template_csv(), "digium_call_data_template.csv", "text/csv")
+        mapping_file = st.file_uploader(
+            "Upload Agent-Extension Mapping File (Optional)", type=["xlsx"], accept_multiple_files=False,
+            help="Columns: Extension, Agent Name, and optionally Effective From / Effective To dates for reassigned extensions."
+        )
+        if mapping_file and st.session_state.get('agent_map_file') != mapping_file.file_id:
             try:
-                st.session_state['agent_map_custom'] = load_agent_mapping_from_file(mapping_file)
+                agent_map = load_agent_mapping_from_file(mapping_file)
+                if agent_map is not None:
+                    st.session_state['agent_map_custom'] = agent_map
+                    st.session_state['agent_map_file'] = mapping_file.file_id
+                    # Relabel the loaded calls instead of reprocessing them
+                    dataset = get_dataset()
+                    if dataset is not None:
+                        df_remapped = remap_agent_names(dataset['df'], agent_map)
+                        key = dataset_key(st.session_state['dataset_key'], agent_map_fingerprint(agent_map))
+                        register_dataset(key, derive_dataset(
+                            dataset, df=df_remapped, cube=build_call_cube(df_remapped), memory_report=memory_report(df_remapped)
+                        ))
+                        st.session_state['dataset_key'] = key
+                        st.session_state['filter_rows'] = None
             except Exception as e:
                 st.error(f"Error reading agent mapping file: {e}")
+        rules_file = st.file_uploader(
+            "Upload Call Category Rules (Optional)", type=["toml"], accept_multiple_files=False,
+            help="Ordered rules matching Queue IDs, a pattern in From, or Extensions; see the downloadable rules file."
+        )
+        if rules_file and st.session_state.get('category_rules_file') != rules_file.file_id:
+            try:
+                st.session_state['category_rules_custom'] = load_call_category_rules(rules_file)
+                st.session_state['category_rules_file'] = rules_file.file_id
+            except Exception as e:
+                st.error(f"Error reading call category rules: {e}")
+        with open(CALL_CATEGORY_RULES_PATH, "rb") as f:
+            st.download_button("Download Call Category Rules", f.read(), "call_categories.toml", "text/plain")
+        # Relabel the loaded calls when the rules (uploaded or the rules file) change, instead of reprocessing them
+        dataset = get_dataset()
+        category_rules = active_call_category_rules()
+        if dataset is not None and dataset.get('category_rules') != category_rules['fingerprint']:
+            df_recategorized = recategorize_calls(dataset['df'], category_rules)
+            key = dataset_key(st.session_state['dataset_key'], category_rules['fingerprint'])
+            register_dataset(key, derive_dataset(
+                dataset, df=df_recategorized, cube=build_call_cube(df_recategorized),
+                memory_report=memory_report(df_recategorized), category_rules=category_rules['fingerprint'],
+            ))
+            st.session_state['dataset_key'] = key
+            st.session_state['filter_rows'] = None
         with st.form(key='poa_form'): 
             col1, col2 = st.columns(2) 
             with col1: 
@@ -114,6 +255,11 @@ with col_upload:
                 tsg_defects = st.number_input("TSG Defects (%)", value=st.session_state.poa_tsg_defects, help = "TSG Technical Support Group") 
                 #conv_mttr = st.number_input("Conventional MTTR (hrs)", value=st.session_state.poa_conventional_mttr) 
                 auto_wait = st.number_input("Automation Wait Time (0-5min) (%)", value=st.session_state.poa_automation_wait) 
+                answer_threshold = st.number_input(
+                    "Answered Within (min)", min_value=0.5, max_value=120.0, step=0.5,
+                    value=float(st.session_state.answer_threshold_min),
+                    help="Threshold for the % answered KPIs and the Automation Wait Time POA",
+                )
     
             with col2: 
                 #sfr_wait = st.number_input("Facility SFR Wait Time (0-5min) (%)", value=st.session_state.poa_facility_sfr) 
@@ -126,8 +272,16 @@ with col_upload:
                 st.session_state.poa_tsg_defects = tsg_defects 
                 st.session_state.poa_base_defects = base_defects 
                 st.session_state.poa_automation_wait = auto_wait 
+                st.session_state.answer_threshold_min = answer_threshold
                 st.session_state.poa_automation_mttr = auto_mttr 
                 st.success("POA settings saved!")
+        loaded = get_filtered_df()
+        actual_wait = automation_wait_pct(loaded) if loaded is not None else None
+        if actual_wait is not None:
+            st.caption(
+                f"Automation Wait Time: {actual_wait:.1f}% answered within {answer_threshold_min():g} min "
+                f"(POA {st.session_state.poa_automation_wait:g}%)"
+            )
     
 with col_settings: 
     smc_form()
@@ -137,19 +291,28 @@ st.divider()
 # --- Data Preview Section --- 
 c1, c2, c3 = st.columns([0.5, 0.3, 0.2])
 with c1:
-    df_preview = st.session_state.get("df_filtered") 
+    df_preview = get_filtered_df()
     # The call_data_uploaded key is now initialized in initialize_session_state()
     if df_preview is not None and not df_preview.empty: 
         display_active_filters() # Show which filters are applied 
 
     # You can add a preview chart here if you have a simple one, like bar_v1 
     # For example: bar_v1(df_preview) 
-    elif st.session_state.get("df_original") is not None:
+    elif get_dataset() is not None:
         st.info('Your data has been loaded. Use the sidebar to apply filters and preview the data.')
         # Set a session state flag if call data is uploaded
         st.session_state['call_data_uploaded'] = True
     else: 
         st.warning('No Call Data: Please upload your main call data file in "Upload Digium Data" to activate the dashboard.') 
+    dataset = get_dataset()
+    if dataset is not None:
+        with st.expander("Memory Report"):
+            st.caption("Bytes per column before and after the compact schema is applied at upload.")
+            st.dataframe(dataset["memory_report"], use_container_width=True, hide_index=True)
+    weekly_fig = chart_weekly_call_volume(dataset["rollups"]) if dataset is not None else None
+    if weekly_fig is not None:
+        with st.expander("Loaded History"):
+            st.plotly_chart(weekly_fig, use_container_width=True)
 
 with c2:
     with st.expander("Preview SMC Data"):
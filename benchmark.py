@@ -0,0 +1,189 @@
+# benchmark.py
+#python benchmark.py features --rows 10000 1000000 5000000
+#python benchmark.py filters
+#python benchmark.py holds
+#python benchmark.py staffing --rows 35040 105120
+"""Timing harness for the call data pipeline.
+
+Each benchmark builds a synthetic Digium-shaped frame, runs the current
+implementation next to the original row-wise version it replaced, checks that
+both produce the same output, and prints the timings.
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import (
+    DEFAULT_AGENT_MAP, HOLD_BIN_EDGES, STAFFING_INTERVAL_MIN, WEEKDAYS, apply_compact_schema, assign_call_category,
+    assign_shift, build_filter_index, daily_hold_histograms, erlang_a_service_level, erlang_agents, filter_rows,
+    hold_histogram, sort_by_start_time,
+)
+
+QUEUE_IDS = np.array(["807", "888", "316", "901", "806", "904", "304", "854", "910", "999"], dtype=object)
+
+
+def synthetic_call_data(rows, seed=0):
+    """Builds a frame with the columns the feature engineering step reads."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2025-01-01T00:00:00") + rng.integers(0, 180 * 86400, rows).astype("timedelta64[s]")
+    return pd.DataFrame({
+        "Start Time": pd.to_datetime(start),
+        "Queue ID": QUEUE_IDS[rng.integers(0, len(QUEUE_IDS), rows)],
+        "From": np.where(rng.random(rows) < 0.05, "Return-UPS <+15555550100>", "Auto-UPS <+15555550100>"),
+        "Hold Time (s)": rng.exponential(240, rows).astype(np.int32),
+    })
+
+
+def legacy_get_shift(row):
+    call_time = row['Start Time'].time()
+    preload_start = pd.to_datetime('04:30:00').time()
+    twilight_start = pd.to_datetime('12:30:00').time()
+    night_start = pd.to_datetime('20:30:00').time()
+    if preload_start <= call_time < twilight_start:
+        return "Preload (4:30am - 12:29pm)"
+    elif twilight_start <= call_time < night_start:
+        return "Twilight (12:30pm - 8:29pm)"
+    else:
+        return "Night (8:30pm - 4:29am)"
+
+
+def legacy_assign_call_category(row):
+    queue_id = str(row["Queue ID"])
+    if queue_id == "304": return "CBRE SFR"
+    elif queue_id == "316": return "CBRE Legacy"
+    elif queue_id == "901":
+        return "Returned Automation" if "return" in str(row["From"]).lower() and queue_id == "999" else "Automation"
+    elif queue_id in ["854", "910"]: return "Managers"
+    else: return "Other"
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_features(rows, legacy_max_rows):
+    """Shift and Call Category: row-wise apply vs vectorized engine."""
+    df = synthetic_call_data(rows)
+    shift, t_shift = _timed(assign_shift, df["Start Time"])
+    category, t_category = _timed(assign_call_category, df)
+    new_total = t_shift + t_category
+    # The legacy apply runs at roughly a millisecond per row, so above the cap it is
+    # timed on a sample and scaled up linearly.
+    sample = df.iloc[:legacy_max_rows]
+    old_shift, t_old_shift = _timed(sample.apply, legacy_get_shift, 1)
+    old_category, t_old_category = _timed(sample.apply, legacy_assign_call_category, 1)
+    assert (old_shift.to_numpy() == shift[:len(sample)]).all(), "Shift output differs from legacy"
+    # the legacy returned-automation branch could never fire; the rules label those 901 legs separately
+    expected = np.asarray(category[:len(sample)], dtype=object)
+    expected[expected == "Returned Automation"] = "Automation"
+    assert (old_category.to_numpy() == expected).all(), "Call Category output differs from legacy"
+    old_total = (t_old_shift + t_old_category) * rows / len(sample)
+    label = "legacy" if len(sample) == rows else "legacy est."
+    print(f"{rows:>10,} rows | vectorized {new_total:8.3f}s | {label:>11} {old_total:9.3f}s | speedup {old_total / new_total:8.1f}x")
+
+
+def legacy_filter_mask(df, start_date, end_date, selected_days, selected_shifts, selected_categories, selected_agents):
+    day_mask = df["DayOfWeek"].isin(selected_days)
+    return (
+        (df["Start Time"].dt.date >= start_date) & (df["Start Time"].dt.date <= end_date) &
+        (day_mask) &
+        (df["Shift"].isin(selected_shifts)) &
+        (df["Call Category"].isin(selected_categories)) &
+        (df["AgentName"].isin(selected_agents))
+    )
+
+
+def bench_filters(rows, legacy_max_rows):
+    """Sidebar filters: per-rerun isin/dt.date scans vs the indexed filter engine (agent selection change)."""
+    rng = np.random.default_rng(1)
+    df = sort_by_start_time(synthetic_call_data(rows))  # uploads are time-ordered at ingest
+    df["DayOfWeek"] = df["Start Time"].dt.day_name()
+    df["Shift"] = assign_shift(df["Start Time"])
+    df["Call Category"] = assign_call_category(df)
+    agents = np.array(list(DEFAULT_AGENT_MAP.values()), dtype=object)
+    df["AgentName"] = agents[rng.integers(0, len(agents), rows)]
+    df = apply_compact_schema(df)
+    start_date, end_date = datetime.date(2025, 2, 1), datetime.date(2025, 4, 30)
+    selections = {
+        "DayOfWeek": WEEKDAYS,
+        "Shift": sorted(df["Shift"].unique()),
+        "Call Category": ["Automation"],
+        "AgentName": sorted(df["AgentName"].unique()),
+    }
+    index, t_build = _timed(build_filter_index, df)
+    cache = {}  # the sidebar keeps one per session, so masks of unchanged filters are reused
+    filter_rows(index, start_date, end_date, selections, cache=cache)
+    selections["AgentName"] = selections["AgentName"][1:]
+    positions, t_new = _timed(lambda: filter_rows(index, start_date, end_date, selections, cache=cache))
+    # the legacy scan is linear and cheap enough per row to time in full
+    mask, t_old = _timed(legacy_filter_mask, df, start_date, end_date, *selections.values())
+    assert np.array_equal(positions, np.flatnonzero(mask.to_numpy())), "Filtered rows differ from legacy"
+    print(f"{rows:>10,} rows | index build {t_build:6.3f}s | indexed {t_new * 1000:8.1f}ms | legacy {t_old * 1000:9.1f}ms | speedup {t_old / t_new:6.1f}x")
+
+
+def legacy_hold_breakdown(df):
+    hold_min = pd.to_numeric(df["Hold Time (s)"], errors="coerce") / 60
+    bins = [0, 5, 10, 15, 30, float("inf")]
+    labels = ["0–5 min", "5–10 min", "10–15 min", "15–30 min", "30+ min"]
+    hold_range = pd.cut(hold_min, bins=bins, labels=labels, right=False).rename("Hold Range")
+    return hold_range.value_counts(normalize=False, sort=False)
+
+
+def bench_holds(rows, legacy_max_rows):
+    """Hold time donut: pd.cut + value_counts vs the histogram kernel, and a date range summed from per-day histograms."""
+    df = sort_by_start_time(synthetic_call_data(rows))
+    counts, t_new = _timed(hold_histogram, df["Hold Time (s)"].to_numpy(), HOLD_BIN_EDGES)
+    old, t_old = _timed(legacy_hold_breakdown, df)
+    assert (old.to_numpy() == counts).all(), "Hold histogram differs from legacy"
+    # per-day histograms are built once at upload; any range is then a sum of a few rows
+    daily, t_daily = _timed(daily_hold_histograms, df)
+    start, end = pd.Timestamp("2025-01-15"), pd.Timestamp("2025-06-14")
+    summed, t_range = _timed(lambda: daily.loc[start:end].sum().to_numpy())
+    in_range = df[(df["Start Time"] >= start) & (df["Start Time"] < end + pd.Timedelta(days=1))]
+    assert (legacy_hold_breakdown(in_range).to_numpy() == summed).all(), "Per-day histograms differ from legacy"
+    print(f"{rows:>10,} rows | kernel {t_new * 1000:8.1f}ms | pd.cut {t_old * 1000:8.1f}ms | speedup {t_old / t_new:6.1f}x"
+          f" | per-day build {t_daily:6.3f}s, 5-month range {t_range * 1000:6.2f}ms")
+
+
+def bench_staffing(rows, legacy_max_rows, target_pct=90.0, threshold_s=300, checked=200):
+    """Staffing: Erlang C and Erlang A agents for every interval in one sweep (rows = 15-minute intervals)."""
+    rng = np.random.default_rng(2)
+    arrivals = rng.poisson(rng.uniform(1, 60, rows)).astype(float)
+    aht = rng.uniform(60, 400, rows)
+    abandon_rate = rng.uniform(1 / 3600, 1 / 30, rows)  # patience of 30 s to an hour
+    erlang_c, t_c = _timed(erlang_agents, arrivals, aht, target_pct, threshold_s)
+    erlang_a, t_a = _timed(erlang_agents, arrivals, aht, target_pct, threshold_s, abandon_rate)
+    # a sample of intervals solved one at a time, counting agents up until the target is met
+    for i in range(min(checked, rows)):
+        n = 0 if arrivals[i] == 0 else 1
+        while n and n < 1000 and erlang_a_service_level(n, arrivals[i:i + 1], aht[i:i + 1], abandon_rate[i:i + 1], threshold_s,
+                                                  STAFFING_INTERVAL_MIN * 60)[0] < target_pct:
+            n += 1
+        assert erlang_a[i] == n, "Erlang A agents differ from the one-interval search"
+    print(f"{rows:>10,} rows | Erlang C {t_c * 1000:8.1f}ms | Erlang A {t_a * 1000:8.1f}ms"
+          f" | mean agents C {erlang_c.mean():6.2f}, A {erlang_a.mean():6.2f}")
+
+
+BENCHMARKS = {
+    "features": bench_features,
+    "filters": bench_filters,
+    "holds": bench_holds,
+    "staffing": bench_staffing,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 5_000_000])
+    parser.add_argument("--legacy-max-rows", type=int, default=20_000,
+                        help="Time the slow legacy implementation on at most this many rows and extrapolate")
+    args = parser.parse_args()
+    print(BENCHMARKS[args.benchmark].__doc__)
+    for rows in args.rows:
+        BENCHMARKS[args.benchmark](rows, args.legacy_max_rows)
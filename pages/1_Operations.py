@@ -3,12 +3,16 @@ import streamlit as st
 from datetime import datetime
 from utils import (
     create_global_sidebar,
+    get_filtered_df,
     chart_calls_by_category,
     donut_hold_time_breakdown,
     display_active_filters,
     hold_top3_shift,
     calls_by_day_bar,
     gt_2_traverse,
+    concurrent_calls,
+    transfer_flow,
+    repeat_callers,
 )
 # --- Page Setup ---
 st.set_page_config( 
@@ -27,10 +31,10 @@ if 'filter_selections' in st.session_state and "Date Range" in st.session_state[
 st.markdown("Internal call handling and routing performance.")
 create_global_sidebar()
 # --- Data Loading and Validation ---
-if 'df_filtered' not in st.session_state or st.session_state['df_filtered'] is None:
+df = get_filtered_df()
+if df is None:
     st.warning("Please upload and filter data on the Home page to view this report.")
     st.stop()
-df = st.session_state['df_filtered']
 # Display the active filters for context
 if df.empty:
         st.warning("No data loaded yet. Please upload a file on the Home page.")
@@ -62,7 +66,7 @@ with tab1:
             st.metric("Avg. Hold Time (m)", f"{automation_df['Hold Time (s)'].mean() / 60:.2f}")
             calls_by_day_bar()
             
-            df = st.session_state['df_filtered']
+            df = get_filtered_df()
             hold_top3_shift(df)
             
         
@@ -77,6 +81,12 @@ with tab1:
                 st.plotly_chart(hold_donut, use_container_width=True)
     
         gt_2_traverse()
+        st.subheader("Transfer Flow")
+        transfer_flow()
+        st.subheader("Repeat Callers")
+        repeat_callers()
+        st.subheader("Concurrent Calls")
+        concurrent_calls()
 
 #st.info("More data here will include a way to see what calls led to longer hold times, what calls have longest MMTR, breakdown of SLAW trends, link call to ticket data")
 with tab2:
@@ -99,7 +109,7 @@ with tab2:
     st.info("1. Use the `Call Data Retrieval Tool.exe` app after configuring the config.ini file to have 6 months of historical data.  \n " \
             "2. Upload CSV file on `Home` page  \n"
             "3. View results here:")
-    df = st.session_state['df_filtered']
+    df = get_filtered_df()
     if df.empty:
         st.info("No data available for hold time analysis.")
     else:
@@ -1,7 +1,7 @@
 # pages/3_Custom_Report_Builder.py
 import streamlit as st
 import pandas as pd
-from utils import create_global_sidebar, display_active_filters # NEW
+from utils import create_global_sidebar, display_active_filters, get_filtered_df, get_cube_cells, cube_aggregate, CUBE_DIMENSIONS, CUBE_MEASURES, CUBE_AGGREGATIONS
 # --- Page Setup ---
 st.set_page_config( 
     page_title="Custom Dashboard", 
@@ -12,10 +12,10 @@ st.title("Custom Report Builder")
 st.markdown("Select dimensions and metrics to build your own summary table from the filtered data.")
 create_global_sidebar()
 # --- Data Loading and Validation ---
-if 'df_filtered' not in st.session_state or st.session_state['df_filtered'] is None:
+df = get_filtered_df()
+if df is None:
     st.warning("Please upload and filter data to build a report.")
     st.stop()
-df = st.session_state['df_filtered'].copy()
 if df.empty:
     st.warning("No data loaded yet. Please upload a file on the Home page.")
     st.stop()
@@ -26,7 +26,7 @@ st.divider()
 c1, c2, c3 = st.columns(3)
 with c1:
     # Let the user choose how to group the data
-    dimensions_all = df.select_dtypes(include='object').columns.tolist()
+    dimensions_all = df.select_dtypes(include=['object', 'category']).columns.tolist()
     # Add key categorical columns that might not be 'object' type
     dimensions_all.extend(['DayOfWeek', 'Hour', 'Queue ID', 'Shift', 'AgentName'])
     selected_dims = st.multiselect(
@@ -46,7 +46,7 @@ with c3:
     # Let the user choose how to calculate
     agg_func = st.selectbox(
         "Using function:",
-        options=["sum", "mean", "count", "max", "min"],
+        options=["sum", "mean", "count", "max", "min", "std", "median"],
         index=1 # Default to mean (average)
     )
 # --- Generate and Display Report ---
@@ -57,13 +57,20 @@ elif df.empty:
     st.info("No data available for the current filter selections to build a report.")
 else:
     try:
-        # Create the aggregation dictionary
-        agg_dict = {metric: agg_func for metric in selected_metrics}
-        # Always include a count of the calls in the group
-        agg_dict['Call ID'] = 'count'
-        # The powerful groupby and aggregation function
-        report_df = df.groupby(selected_dims, as_index=False).agg(agg_dict)
-        report_df.rename(columns={'Call ID': 'Number of Calls'}, inplace=True)
+        cells = get_cube_cells(df)
+        if (cells is not None and set(selected_dims) <= set(CUBE_DIMENSIONS)
+                and set(selected_metrics) <= set(CUBE_MEASURES) and agg_func in CUBE_AGGREGATIONS):
+            # Rolled up from the pre-aggregated cube instead of scanning every call leg
+            report_df = cube_aggregate(cells, selected_dims, selected_metrics, agg_func)
+            report_df.rename(columns={'Legs': 'Number of Calls'}, inplace=True)
+        else:
+            # Create the aggregation dictionary
+            agg_dict = {metric: agg_func for metric in selected_metrics}
+            # Always include a count of the calls in the group
+            agg_dict['Call ID'] = 'count'
+            # The powerful groupby and aggregation function
+            report_df = df.groupby(selected_dims, as_index=False, observed=True).agg(agg_dict)
+            report_df.rename(columns={'Call ID': 'Number of Calls'}, inplace=True)
         st.subheader("Your Custom Report")
         st.dataframe(report_df)
         csv = report_df.to_csv(index=False).encode('utf-8')
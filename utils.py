@@ -2,21 +2,94 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 #from weasyprint import HTML
 import base64
 import numpy as np
 import tempfile
 from smc import smc_metrics
 import decimal
+import sys
+import os
+import re
+import tomllib
+import json
+import hashlib
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # optional: without pyarrow the pandas C reader is used
+    pa = None
 
 
 
 # --- 1. Constants, Colors, and Default Mappings ---
+# Column layout of a Digium call export: name -> (dtype it is read as, required).
+# Declaring dtypes up front spares the readers from inferring them; the same schema
+# produces the template CSV offered on the Home page.
+DIGIUM_SCHEMA = {
+    "Call ID": ("int64", True),
+    "Start Time": ("string", True),  # parsed with DIGIUM_TIME_FORMAT after reading
+    "From": ("string", True),
+    "To": ("string", True),
+    "Total Duration": ("float64", True),
+    "Talk Duration": ("float64", True),
+    "Who Hung Up": ("string", True),
+    "Abandoned": ("bool", True),
+    "Traversed": ("string", False),
+    "Hold Segments": ("string", False),
+    "Talk Segments": ("string", False),
+    "Queue ID": ("string", True),
+    "Hold Time (s)": ("float64", True),
+    "Talk Time (s)": ("float64", False),
+    "Extension": ("string", True),
+}
+DIGIUM_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 # columns that MUST exist in the uploaded Digium CSV
-REQUIRED_COLUMNS = {
-    "Call ID", "Start Time", "From", "To", "Total Duration", "Talk Duration",
-    "Who Hung Up", "Abandoned", "Hold Time (s)", "Queue ID", "Extension"
+REQUIRED_COLUMNS = {col for col, (_, required) in DIGIUM_SCHEMA.items() if required}
+# rows (pandas reader) or bytes (pyarrow reader) read from an uploaded CSV at a time;
+# bounds peak memory for multi-month exports
+CSV_CHUNK_ROWS = 100_000
+CSV_CHUNK_BYTES = 32 * 1024 * 1024
+# a call leg is identified by these columns; overlapping exports repeat the same legs
+LEG_KEY_COLUMNS = ["Call ID", "Queue ID", "Start Time", "Extension"]
+# hold time histogram bins in seconds (0–5, 5–10, 10–15, 15–30, 30+ minutes), left-closed like the donut charts
+HOLD_BIN_EDGES = np.array([0, 300, 600, 900, 1800])
+HOLD_RANGE_LABELS = ["0–5 min", "5–10 min", "10–15 min", "15–30 min", "30+ min"]
+# Traversed, Hold Segments and Talk Segments entries, e.g. "Queue: 807", "Queue: 807 = 11s",
+# "Extension: 119 for 6 minutes, 39 seconds = 399s"; segments are "; " separated
+SEGMENT_KINDS = ["Queue", "Extension"]
+SEGMENT_PATTERNS = {
+    "Traversed": r"(?P<Kind>Queue|Extension): (?P<Node>[^;\s]+)",
+    "Hold Segments": r"Queue: (?P<Node>[^;\s]+) = (?P<Seconds>\d+)s",
+    "Talk Segments": r"Extension: (?P<Node>[^;\s]+) for [^;=]*= (?P<Seconds>\d+)s",
 }
+# processed uploads are cached as Parquet here, least recently used files evicted past the size cap
+PROCESSED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "processed")
+PROCESSED_CACHE_MAX_BYTES = 1024 ** 3
+# bump whenever the processed frame's columns or dtypes change so stale cache entries are skipped
+PROCESSED_CACHE_VERSION = 3
+# Per-day, per-queue sketches kept across uploads for the year-to-date charts. Hold and talk
+# time quantiles come from log-spaced buckets (as in DDSketch): a reported quantile is within
+# SKETCH_RELATIVE_ACCURACY of the true value. Distinct callers and Call IDs use HyperLogLog
+# with 2**HLL_PRECISION registers, a standard error of 1.04 / sqrt(2**HLL_PRECISION) (~2.3%).
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+# bucket lower bounds in seconds: [0, 1) then [gamma**k, gamma**(k+1)) up to a day; longer falls in the last
+SKETCH_EDGES = np.concatenate([[0.0], SKETCH_GAMMA ** np.arange(int(np.ceil(np.log(86400) / np.log(SKETCH_GAMMA))) + 1)])
+HLL_PRECISION = 11
+_POWERS_OF_TWO = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+# sketch arrays and the ufunc that merges two rows of each
+SKETCH_ARRAYS = {"hold": np.add, "talk": np.add, "callers": np.maximum, "call_ids": np.maximum}
+SKETCH_STORE_PATH = os.path.join(os.path.dirname(PROCESSED_CACHE_DIR), "sketches.npz")
+# a loaded dataset is dropped from the shared registry once no session has touched it for this long
+DATASET_IDLE_MINUTES = 30
 # The official UPS color palette for consistent branding in charts
 UPS_COLORS = [
     "#351c15",  # UPS Brown
@@ -50,82 +123,1469 @@ DEFAULT_AGENT_MAP = {
     904: "CBRE Transfer Queue", 905: "Fire Transfer", 910: "GTSG Leadership",
     999: "BaSE Main"
 }
+# Aggregate cube built at ingest: one cell per combination of these columns (Date is the
+# Start Time day), holding the leg count and, per measure, its sum, sum of squares, min and max
+CUBE_DIMENSIONS = ["Date", "DayOfWeek", "Hour", "Shift", "Call Category", "Queue ID", "AgentName"]
+CUBE_MEASURES = ["Hold Time (s)", "Talk Time (s)", "Talk Duration", "Total Duration"]
+# aggregations answered from cube cells; any other (e.g. median) has to read the legs
+CUBE_AGGREGATIONS = ["sum", "mean", "count", "max", "min", "std"]
+# headline KPIs computed per filter state, kept per dataset entry (oldest dropped first)
+KPI_CACHE_SIZE = 32
+# filtered frames shared by the sessions on a dataset, one per filter state (oldest dropped first)
+VIEW_CACHE_SIZE = 4
+# repeat callers: a call counts as a repeat when the same number called within the window
+# before it; numbers are the digits in From's <...>, without the +1 country code
+REPEAT_WINDOWS = {"1 Hour": 3600, "1 Day": 86400}
+# the CBRE transfer line shows up in From for transferred calls; it is not the caller's number
+REPEAT_EXCLUDED_NUMBERS = [8443954527]
+# transfer flow view: most frequent full paths listed, heaviest hops drawn in the Sankey
+TRANSFER_TOP_PATHS = 10
+TRANSFER_SANKEY_EDGES = 40
+# longest holds listed by the top-N KPI
+TOP_HOLDS = 3
+# default "% answered within" threshold in minutes; Home's POA settings override it per session
+ANSWER_THRESHOLD_MIN = 5
+# staffing model: arrivals and handle times are taken per interval of this many minutes,
+# and required agent-hours are turned into shifts of SHIFT_HOURS
+STAFFING_INTERVAL_MIN = 15
+SHIFT_HOURS = 8
+# Erlang A: callers finding more than this many others waiting are counted as unanswered
+ERLANG_A_MAX_QUEUE = 200
+# Categorical columns the global sidebar filters on, besides the Start Time date range
+FILTER_DIMENSIONS = ["DayOfWeek", "Shift", "Call Category", "AgentName"]
+# Columns of a dated agent mapping: who held an extension and over which dates (blank = open-ended)
+AGENT_MAP_COLUMNS = ["Extension", "AgentName", "Effective From", "Effective To"]
+# Shift start times as seconds past midnight. A call belongs to the last boundary
+# it has passed; anything before 4:30am wraps around into the previous Night shift.
+SHIFT_BOUNDARIES = np.array([4 * 3600 + 30 * 60, 12 * 3600 + 30 * 60, 20 * 3600 + 30 * 60])
+SHIFT_LABELS = np.array([
+    "Night (8:30pm - 4:29am)",
+    "Preload (4:30am - 12:29pm)",
+    "Twilight (12:30pm - 8:29pm)",
+    "Night (8:30pm - 4:29am)",
+], dtype=object)
+# Ordered call category rules (queue sets, a regex on From, extension sets); see the file for the format
+CALL_CATEGORY_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "call_categories.toml")
+CALL_CATEGORY_CONDITIONS = ["queues", "from", "extensions"]
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# Compact dtypes applied at ingest. Low-cardinality text becomes categorical (integer codes
+# plus one copy of each label) and whole-second durations fit comfortably in int32.
+COMPACT_SCHEMA = {
+    "Queue ID": "category",
+    "Extension": "category",
+    "Shift": pd.CategoricalDtype(pd.unique(SHIFT_LABELS)),
+    "DayOfWeek": pd.CategoricalDtype(WEEKDAYS, ordered=True),
+    "AgentName": "category",
+    "Call Category": "category",
+    "Who Hung Up": "category",
+    "From": "category",
+    "To": "category",
+    "Abandoned": "boolean",
+    "Total Duration": "int32",
+    "Talk Duration": "int32",
+    "Hold Time (s)": "int32",
+    "Talk Time (s)": "int32",
+}
 # --- 2. Data Loading and Processing Functions ---
-def get_name_from_extension(extension_id):
-    try:
-        # Prioritize custom map from session state, fall back to default
-        agent_map = st.session_state.get('agent_map_custom') or DEFAULT_AGENT_MAP
-        return agent_map.get(str(extension_id), f"Unknown Ext {extension_id}")
-    except (ValueError, TypeError):
-        return str(extension_id) # Return as string if not a valid integer
-@st.cache_data
-def process_uploaded_file(uploaded_file):
-    """Loads, validates, cleans, and engineers features from the uploaded call data."""
-    try:
-        df = pd.read_csv(uploaded_file)
-    except Exception as e:
-        st.error(f"Error reading the CSV file: {e}")
-        return None
+def _extension_key(value):
+    """Extension as a lookup key: mapping files give ints, exports give strings (sometimes "119.0")."""
+    text = str(value).strip()
+    return text[:-2] if text.endswith(".0") else text
+def active_agent_map():
+    """The uploaded agent mapping if there is one, otherwise the default map."""
+    agent_map = st.session_state.get('agent_map_custom')
+    return DEFAULT_AGENT_MAP if agent_map is None else agent_map
+def resolve_agent_names(extensions, agent_map=None, start_times=None):
+    """Maps extensions to agent names as a categorical, looking up each distinct extension once.
+
+    Extensions are encoded as categorical codes, the categories are mapped through the agent
+    map, and the per-row result is a gather of those names by code. A dated map (a frame of
+    AGENT_MAP_COLUMNS, see load_agent_mapping_from_file) is resolved against start_times instead.
+    """
+    if isinstance(agent_map, pd.DataFrame):
+        return _resolve_dated_agent_names(extensions, agent_map, start_times)
+    lookup = {_extension_key(ext): name for ext, name in (agent_map or DEFAULT_AGENT_MAP).items()}
+    codes = pd.Categorical(extensions)
+    # one name per category, plus a trailing slot that missing extensions (code -1) land on
+    names = [lookup.get(_extension_key(ext), f"Unknown Ext {ext}") for ext in codes.categories] + ["Unknown Ext nan"]
+    name_codes, labels = pd.factorize(np.array(names, dtype=object))
+    return pd.Series(
+        pd.Categorical.from_codes(name_codes[codes.codes], categories=labels),
+        index=getattr(extensions, "index", None),
+    )
+def _resolve_dated_agent_names(extensions, periods, start_times):
+    """Name in effect at each leg's start time, found with one merge_asof by extension.
+
+    The latest period that began at or before the call applies (a blank Effective From means
+    it always has). If that period has ended (Effective To counts the whole day) or the
+    extension has no period at all, the leg is labelled "Unknown Ext".
+    """
+    codes = pd.Categorical(extensions)
+    key_codes, keys = pd.factorize(np.array([_extension_key(ext) for ext in codes.categories], dtype=object))
+    period_key = pd.Index(keys).get_indexer(periods["Extension"].map(_extension_key))
+    periods, period_key = periods[period_key >= 0], period_key[period_key >= 0]
+    name_codes, names = pd.factorize(periods["AgentName"].astype(str))
+    effective_to = pd.to_datetime(periods["Effective To"]).dt.normalize() + pd.Timedelta(days=1)
+    right = pd.DataFrame({
+        "key": period_key,
+        "Effective From": pd.to_datetime(periods["Effective From"]).fillna(pd.Timestamp.min).astype("datetime64[ns]").to_numpy(),
+        "Ends": effective_to.fillna(pd.Timestamp.max).astype("datetime64[ns]").to_numpy(),
+        "name": name_codes,
+    }).sort_values("Effective From", kind="stable")
+    leg_key = np.where(codes.codes >= 0, key_codes[codes.codes], -1)
+    start = pd.Series(start_times).astype("datetime64[ns]").to_numpy()
+    order = np.argsort(start, kind="stable")
+    merged = pd.merge_asof(
+        pd.DataFrame({"key": leg_key[order], "Start Time": start[order]}), right,
+        left_on="Start Time", right_on="Effective From", by="key", direction="backward",
+    )
+    matched = (merged["name"].notna() & (merged["Start Time"] < merged["Ends"])).to_numpy()
+    # label slots: the period names, then one "Unknown Ext" per extension category plus missing
+    unknown = [f"Unknown Ext {ext}" for ext in codes.categories] + ["Unknown Ext nan"]
+    label_codes, labels = pd.factorize(np.concatenate([np.asarray(names, dtype=object), np.array(unknown, dtype=object)]))
+    unknown_slot = len(names) + np.where(codes.codes >= 0, codes.codes, len(codes.categories))
+    slot = np.empty(len(start), dtype=np.int64)
+    slot[order] = np.where(matched, merged["name"].fillna(-1).to_numpy(np.int64), unknown_slot[order])
+    return pd.Series(
+        pd.Categorical.from_codes(label_codes[slot], categories=labels),
+        index=getattr(extensions, "index", None),
+    )
+def remap_agent_names(df, agent_map=None):
+    """Relabels AgentName on a processed frame for a new agent map without reprocessing it."""
+    df = df.copy(deep=False)
+    df['AgentName'] = resolve_agent_names(df['Extension'], agent_map, df['Start Time'])
+    return df
+def assign_shift(start_times):
+    """Labels each start time with its shift using one searchsorted over seconds-of-day."""
+    seconds = start_times.to_numpy().astype("datetime64[s]").astype(np.int64) % 86400
+    return SHIFT_LABELS[np.searchsorted(SHIFT_BOUNDARIES, seconds, side="right")]
+def compile_call_category_rules(config):
+    """Validates parsed rules (see call_categories.toml) into the form assign_call_category applies.
+
+    Queue and extension sets become sets of strings (extensions as lookup keys, see
+    _extension_key) and From patterns are compiled once.
+    The result also lists the categories in rule order (default last) and a fingerprint
+    of the rules. Raises ValueError on a malformed rule.
+    """
+    default = str(config.get("default", "Other"))
+    rules = []
+    for i, rule in enumerate(config.get("rule", []), start=1):
+        unknown = set(rule) - set(CALL_CATEGORY_CONDITIONS) - {"category"}
+        if "category" not in rule or unknown:
+            raise ValueError(f"Rule {i} needs a category and only {', '.join(CALL_CATEGORY_CONDITIONS)} conditions")
+        if not set(rule) & set(CALL_CATEGORY_CONDITIONS):
+            raise ValueError(f"Rule {i} ({rule['category']}) has no conditions")
+        try:
+            pattern = re.compile(rule["from"], re.IGNORECASE) if "from" in rule else None
+        except re.error as e:
+            raise ValueError(f"Rule {i} ({rule['category']}) has an invalid From pattern: {e}")
+        rules.append({
+            "category": str(rule["category"]),
+            "queues": {str(q) for q in rule["queues"]} if "queues" in rule else None,
+            "from": pattern,
+            "extensions": {_extension_key(e) for e in rule["extensions"]} if "extensions" in rule else None,
+        })
+    categories = list(dict.fromkeys([rule["category"] for rule in rules] + [default]))
+    fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return {"rules": rules, "default": default, "categories": categories, "fingerprint": fingerprint}
+def load_call_category_rules(source=CALL_CATEGORY_RULES_PATH):
+    """Reads and compiles category rules from a TOML path or an uploaded file."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return compile_call_category_rules(tomllib.load(f))
+    return compile_call_category_rules(tomllib.loads(source.getvalue().decode("utf-8")))
+@st.cache_resource(max_entries=1)
+def _call_category_rules_snapshot(path, mtime_ns):
+    return load_call_category_rules(path)
+def default_call_category_rules(path=CALL_CATEGORY_RULES_PATH):
+    """The rules file's compiled rules, re-read whenever the file changes."""
+    return _call_category_rules_snapshot(path, os.stat(path).st_mtime_ns)
+def active_call_category_rules():
+    """The uploaded category rules if there are any, otherwise the rules file."""
+    rules = st.session_state.get('category_rules_custom')
+    return default_call_category_rules() if rules is None else rules
+def _match_values(values, predicate):
+    """Row mask from a predicate evaluated once per distinct value (as strings) of a column."""
+    codes, uniques = pd.factorize(values)
+    # code -1 (missing) reads the trailing False
+    return np.append(np.asarray(predicate(pd.Index(uniques).astype(str)), dtype=bool), False)[codes]
+def assign_call_category(df, rules=None):
+    """Labels each call leg with its category by applying compiled rules as vectorized masks.
+
+    Each rule's conditions are evaluated per distinct Queue ID, From and Extension and
+    gathered back to the rows; np.select then takes the first matching rule per leg.
+    """
+    rules = default_call_category_rules() if rules is None else rules
+    masks = []
+    for rule in rules["rules"]:
+        mask = np.ones(len(df), dtype=bool)
+        if rule["queues"] is not None:
+            mask &= _match_values(df["Queue ID"], lambda values: values.isin(rule["queues"]))
+        if rule["from"] is not None:
+            mask &= _match_values(df["From"], lambda values: values.str.contains(rule["from"]))
+        if rule["extensions"] is not None:
+            mask &= _match_values(df["Extension"], lambda values: values.map(_extension_key).isin(rule["extensions"]))
+        masks.append(mask)
+    categories = rules["categories"]
+    default = categories.index(rules["default"])
+    codes = np.select(masks, [categories.index(rule["category"]) for rule in rules["rules"]], default=default) if masks \
+        else np.full(len(df), default)
+    return pd.Categorical.from_codes(codes, categories=categories)
+def recategorize_calls(df, rules=None):
+    """Relabels Call Category on a processed frame for new rules without reprocessing it."""
+    df = df.copy(deep=False)
+    df["Call Category"] = assign_call_category(df, rules)
+    return df
+def parse_start_times(values):
+    """Parses Start Time with the fixed Digium format, retrying only the rows that fail it.
+
+    Returns (datetimes, slow_rows) where slow_rows counts values that needed the slower
+    per-value parser.
+    """
+    parsed = pd.to_datetime(values, format=DIGIUM_TIME_FORMAT, errors="coerce")
+    failed = (parsed.isna() & values.notna()).to_numpy()
+    if failed.any():
+        parsed[failed] = pd.to_datetime(values[failed], format="mixed", errors="coerce")
+    return parsed, int(failed.sum())
+def _clean_call_chunk(df, agent_map=None):
+    """Validates, cleans, and engineers features for one chunk of raw call data.
+
+    Returns (df, slow_rows, dropped_rows) for the parse report.
+    """
     if not REQUIRED_COLUMNS.issubset(df.columns):
         missing = REQUIRED_COLUMNS - set(df.columns)
-        st.error(f"File Structure Mismatch! Missing required columns: {', '.join(missing)}")
-        return None
-    df["Start Time"] = pd.to_datetime(df["Start Time"], errors="coerce")
-    df = df.dropna(subset=["Start Time"])
-    df["Queue ID"] = df["Queue ID"].astype(str).str.strip()
-    df["Extension"] = df["Extension"].astype(str).str.strip()
-    df["Abandoned_Flag"] = df["Abandoned"].astype(str).str.strip().str.lower() == "true"
-    for col in ["Total Duration", "Talk Duration", "Hold Time (s)"]:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+        raise ValueError(f"File Structure Mismatch! Missing required columns: {', '.join(sorted(missing))}")
+    df["Start Time"], slow_rows = parse_start_times(df["Start Time"])
+    rows = len(df)
+    if df["Start Time"].isna().any():
+        df = df[df["Start Time"].notna()].copy()
+    for col in ["Queue ID", "Extension"]:
+        # blank IDs read as NaN or None depending on the reader; both become "nan"
+        df[col] = df[col].astype(str).str.strip().where(df[col].notna(), "nan")
+    if pd.api.types.is_bool_dtype(df["Abandoned"]):
+        df["Abandoned_Flag"] = df["Abandoned"].fillna(False).astype(bool)
+    else:
+        df["Abandoned_Flag"] = df["Abandoned"].astype(str).str.strip().str.lower() == "true"
+    for col in ["Total Duration", "Talk Duration", "Hold Time (s)", "Talk Time (s)"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
     df["Hour"] = df["Start Time"].dt.hour
     df["DayOfWeek"] = df["Start Time"].dt.day_name()
-    def get_shift(row):
-        """Categorizes a call into a shift based on its exact start time."""
-        call_time = row['Start Time'].time()
-        preload_start = pd.to_datetime('04:30:00').time()
-        twilight_start = pd.to_datetime('12:30:00').time()
-        night_start = pd.to_datetime('20:30:00').time()
-        if preload_start <= call_time < twilight_start:
-            return "Preload (4:30am - 12:29pm)"
-        elif twilight_start <= call_time < night_start:
-            return "Twilight (12:30pm - 8:29pm)"
-        else:
-            return "Night (8:30pm - 4:29am)"
-    df['Shift'] = df.apply(get_shift, axis=1)
-    def assign_call_category(row):
-        #logic for returned automation is if "return" in str(row["From"]).lower() and queue_id == "999"
-        queue_id = str(row["Queue ID"])
-        if queue_id == "304": return "CBRE SFR"
-        elif queue_id == "316": return "CBRE Legacy"
-        elif queue_id == "901":
-            return "Returned Automation" if "return" in str(row["From"]).lower() and queue_id == "999" else "Automation"
-        elif queue_id in ["854", "910"]: return "Managers"
-        else: return "Other"
-    df["Call Category"] = df.apply(assign_call_category, axis=1)
+    df["Shift"] = assign_shift(df["Start Time"])
+    df["Call Category"] = assign_call_category(df)
     # Add agent name directly during processing
-    df['AgentName'] = df['Extension'].apply(get_name_from_extension)
+    df['AgentName'] = resolve_agent_names(df['Extension'], agent_map, df['Start Time'])
+    return apply_compact_schema(df), slow_rows, rows - len(df)
+def apply_compact_schema(df):
+    """Casts the columns listed in COMPACT_SCHEMA to their compact dtypes."""
+    return df.astype({col: dtype for col, dtype in COMPACT_SCHEMA.items() if col in df.columns})
+def concat_call_data(frames):
+    """Concatenates processed call frames column by column, keeping categoricals categorical.
+
+    pd.concat falls back to object dtype when frames carry different categories, so those
+    columns are joined with union_categoricals instead. The input frames are not modified.
+    """
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+    all_columns = list(dict.fromkeys(col for f in frames for col in f.columns))
+    frames = [f if len(f.columns) == len(all_columns) else f.reindex(columns=all_columns) for f in frames]
+    columns = {}
+    for col in all_columns:
+        pieces = [f[col] for f in frames]
+        dtypes = [piece.dtype for piece in pieces]
+        if all(isinstance(d, pd.CategoricalDtype) for d in dtypes) and any(d != dtypes[0] for d in dtypes):
+            columns[col] = pd.Series(pd.api.types.union_categoricals(pieces, ignore_order=True))
+        else:
+            columns[col] = pd.concat(pieces, ignore_index=True)
+    return pd.DataFrame(columns)
+def memory_report(df):
+    """Per-column bytes of the compact frame next to what the old object/int64 columns took.
+
+    The "before" size is derived from the compact column itself (an 8-byte pointer per row
+    plus the size of the string it points at), so no uncompacted copy is ever built.
+    """
+    rows = []
+    for col in df.columns:
+        after = int(df[col].memory_usage(deep=True, index=False))
+        dtype = COMPACT_SCHEMA.get(col)
+        if dtype is None:
+            before = after
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            label_sizes = np.array([sys.getsizeof(label) for label in df[col].cat.categories] + [sys.getsizeof(np.nan)])
+            # missing values have code -1; count them against the trailing NaN slot
+            codes = np.where(df[col].cat.codes.to_numpy() < 0, len(label_sizes) - 1, df[col].cat.codes.to_numpy())
+            before = 8 * len(df) + int(np.bincount(codes, minlength=len(label_sizes)) @ label_sizes)
+        else:
+            before = 8 * len(df)
+        rows.append({"Column": col, "Before (MB)": before / 1e6, "After (MB)": after / 1e6})
+    report = pd.DataFrame(rows)
+    report.loc[len(report)] = ["Total", report["Before (MB)"].sum(), report["After (MB)"].sum()]
+    report["Reduction (x)"] = (report["Before (MB)"] / report["After (MB)"]).round(1)
+    return report.round({"Before (MB)": 2, "After (MB)": 2})
+def _pandas_csv_chunks(uploaded_file, chunksize):
+    # Text and flag columns are pinned so every chunk parses them the same way. Numeric
+    # columns are left to inference and coerced afterwards, so a stray non-numeric cell
+    # becomes 0 instead of failing the whole read.
+    dtypes = {"string": str, "bool": "boolean"}
+    yield from pd.read_csv(
+        uploaded_file, chunksize=chunksize,
+        dtype={col: dtypes[dtype] for col, (dtype, _) in DIGIUM_SCHEMA.items() if dtype in dtypes},
+    )
+def _arrow_csv_chunks(uploaded_file, block_size, skip_rows=0, relaxed=False):
+    # skip_rows data rows after the header are not parsed at all. With relaxed, the float and
+    # flag columns are read as text and coerced cell by cell, so a stray value becomes
+    # missing (as with the pandas reader) instead of failing the block.
+    types = {"string": pa.string(), "bool": pa.bool_(), "int64": pa.int64(), "float64": pa.float64()}
+    loose = {"float64", "bool"} if relaxed else set()
+    reader = pa_csv.open_csv(
+        uploaded_file,
+        read_options=pa_csv.ReadOptions(block_size=block_size, skip_rows_after_names=skip_rows),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.string() if dtype in loose else types[dtype] for col, (dtype, _) in DIGIUM_SCHEMA.items()},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        chunk = batch.to_pandas()
+        for col, (dtype, _) in DIGIUM_SCHEMA.items():
+            if col not in chunk.columns or dtype not in loose:
+                continue
+            if dtype == "float64":
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+            else:
+                chunk[col] = chunk[col].str.strip().str.lower().map({"true": True, "false": False}).astype("boolean")
+        yield chunk
+def read_call_data(uploaded_file, chunksize=CSV_CHUNK_ROWS, on_progress=None, agent_map=None, engine=None):
+    """Streams a Digium CSV in bounded chunks, cleaning each chunk before the next is read.
+
+    Only cleaned chunks are kept, so peak memory is the cleaned result plus one raw chunk.
+    Uses pyarrow's streaming CSV reader when installed (`engine="pyarrow"`), or the pandas
+    reader if it is missing. A block pyarrow rejects (e.g. text in a numeric column) is
+    re-read, with the rest of the file, with those columns coerced per cell; the chunks
+    already cleaned are kept. `on_progress` is called with
+    the fraction of the file read so far. A parse report (engine, rows, slow_rows,
+    dropped_rows) is left in `df.attrs["parse_report"]`.
+    """
+    engine = engine or ("pyarrow" if pa is not None else "pandas")
+    uploaded_file.seek(0, 2)
+    total_bytes = uploaded_file.tell() or 1
+    uploaded_file.seek(0)
+    chunks, slow_rows, dropped_rows, rows_read, relaxed = [], 0, 0, 0, False
+    if engine == "pyarrow":
+        reader = _arrow_csv_chunks(uploaded_file, CSV_CHUNK_BYTES)
+    else:
+        reader = _pandas_csv_chunks(uploaded_file, chunksize)
+    while reader is not None:
+        try:
+            for chunk in reader:
+                rows_read += len(chunk)
+                chunk, slow, dropped = _clean_call_chunk(chunk, agent_map)
+                chunks.append(chunk)
+                slow_rows += slow
+                dropped_rows += dropped
+                if on_progress is not None:
+                    on_progress(min(uploaded_file.tell() / total_bytes, 1.0))
+            reader = None
+        except pa.ArrowInvalid if pa is not None else ():
+            uploaded_file.seek(0)
+            if relaxed:
+                # even the relaxed columns parse (e.g. a non-numeric Call ID); the pandas
+                # reader infers the types of the whole file instead
+                return read_call_data(uploaded_file, chunksize, on_progress, agent_map, engine="pandas")
+            # resume at the first row of the rejected block
+            reader = _arrow_csv_chunks(uploaded_file, CSV_CHUNK_BYTES, skip_rows=rows_read, relaxed=True)
+            relaxed = True
+    df = concat_call_data(chunks)
+    df.attrs["parse_report"] = {
+        "engine": engine + (" (relaxed)" if relaxed else ""), "rows": len(df), "slow_rows": slow_rows,
+        "dropped_rows": dropped_rows,
+    }
     return df
-@st.cache_data
+def digium_template_csv():
+    """An empty CSV with the Digium export header, in schema order."""
+    return pd.DataFrame(columns=list(DIGIUM_SCHEMA)).to_csv(index=False).encode('utf-8')
+def upload_cache_key(file_bytes):
+    """Content address of a processed upload.
+
+    Agent names are relabelled with remap_agent_names after loading, so the key covers only
+    the raw CSV bytes and the pipeline version, not the agent map.
+    """
+    digest = hashlib.sha256(f"v{PROCESSED_CACHE_VERSION}:".encode("utf-8"))
+    digest.update(file_bytes)
+    return digest.hexdigest()
+_CACHE_STATS_LOCK = threading.Lock()
+def _update_cache_stats(field):
+    """Counts an upload cache hit or miss in stats.json; sessions run in threads, so the
+    read-modify-write happens under a lock and goes through a temp file."""
+    stats_path = os.path.join(PROCESSED_CACHE_DIR, "stats.json")
+    with _CACHE_STATS_LOCK:
+        try:
+            with open(stats_path) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {"hits": 0, "misses": 0}
+        stats[field] = stats.get(field, 0) + 1
+        tmp_path = None
+        try:
+            os.makedirs(PROCESSED_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=PROCESSED_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, stats_path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+def load_cached_upload(key):
+    """Returns the processed frame stored under `key`, or None on a cache miss."""
+    path = os.path.join(PROCESSED_CACHE_DIR, f"{key}.parquet")
+    try:
+        df = pd.read_parquet(path)
+        os.utime(path)  # mark as recently used for LRU eviction
+    except FileNotFoundError:
+        _update_cache_stats("misses")
+        return None
+    except (OSError, ValueError, ImportError):
+        # unreadable entry (partial write, missing pyarrow); treat as a miss and rebuild it
+        _update_cache_stats("misses")
+        return None
+    _update_cache_stats("hits")
+    return df
+def store_cached_upload(key, df):
+    """Writes a processed frame to the cache, then evicts old entries past PROCESSED_CACHE_MAX_BYTES."""
+    path = os.path.join(PROCESSED_CACHE_DIR, f"{key}.parquet")
+    tmp_path = None
+    try:
+        os.makedirs(PROCESSED_CACHE_DIR, exist_ok=True)
+        # write to a unique temp file first so a concurrent reader never sees a half-written
+        # file and sessions (threads of one process) storing the same key don't collide
+        fd, tmp_path = tempfile.mkstemp(dir=PROCESSED_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            df.to_parquet(f, index=False)
+        os.replace(tmp_path, path)
+    except (OSError, ValueError, ImportError):
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    evict_processed_cache()
+def _cached_upload_files():
+    try:
+        names = [n for n in os.listdir(PROCESSED_CACHE_DIR) if n.endswith(".parquet")]
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        try:
+            info = os.stat(os.path.join(PROCESSED_CACHE_DIR, name))
+        except FileNotFoundError:
+            continue  # evicted by another session meanwhile
+        files.append((info.st_mtime, info.st_size, os.path.join(PROCESSED_CACHE_DIR, name)))
+    return files
+def evict_processed_cache(max_bytes=PROCESSED_CACHE_MAX_BYTES):
+    """Deletes least recently used cache files until the cache fits in `max_bytes`."""
+    files = sorted(_cached_upload_files())
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+def processed_cache_stats():
+    """Hit/miss counters and current size of the on-disk upload cache."""
+    try:
+        with open(os.path.join(PROCESSED_CACHE_DIR, "stats.json")) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    files = _cached_upload_files()
+    return {
+        "hits": stats.get("hits", 0),
+        "misses": stats.get("misses", 0),
+        "entries": len(files),
+        "size_mb": sum(size for _, size, _ in files) / 1e6,
+    }
+def process_uploaded_file(uploaded_file, _on_progress=None):
+    """Loads, validates, cleans, and engineers features from the uploaded call data.
+
+    Results are kept on disk by content hash, so re-uploading the same file in a new
+    session or after a restart skips the pipeline entirely. In memory, loaded data is
+    shared through the dataset registry rather than st.cache_data, which would hand every
+    caller its own unpickled copy.
+    """
+    agent_map = active_agent_map()
+    key = upload_cache_key(uploaded_file.getvalue())
+    df = load_cached_upload(key)
+    if df is not None:
+        return df
+    try:
+        df = read_call_data(uploaded_file, on_progress=_on_progress, agent_map=agent_map)
+    except ValueError as e:
+        st.error(str(e))
+        return None
+    except Exception as e:
+        st.error(f"Error reading the CSV file: {e}")
+        return None
+    store_cached_upload(key, df)
+    return df
+def leg_keys(df):
+    """64-bit hash of each row's leg key (Call ID + Queue ID + Start Time + Extension)."""
+    return pd.util.hash_pandas_object(df[LEG_KEY_COLUMNS], index=False).to_numpy()
+def sort_by_start_time(df):
+    """Puts legs in Start Time order (stable), which lets the filter index slice date ranges directly."""
+    if df["Start Time"].is_monotonic_increasing:
+        return df
+    return df.take(np.argsort(df["Start Time"].to_numpy(), kind="stable")).reset_index(drop=True)
+def merge_call_data(frames):
+    """Concatenates processed frames and drops call legs repeated across files in one hash pass.
+
+    A single export can legitimately hold the same leg key twice (a call that re-enters a
+    queue), so legs are matched on (leg key, occurrence within its file): overlapping exports
+    repeat the same occurrences, which are dropped, while repeats inside one file are kept.
+    Returns (df, duplicates_dropped). Cost is linear in total rows, however many files.
+    """
+    keys, occurrences = [], []
+    for f in frames:
+        key = leg_keys(f)
+        keys.append(key)
+        occurrences.append(pd.Series(key).groupby(key).cumcount().to_numpy())
+    df = concat_call_data(frames)
+    if len(frames) == 1:
+        return sort_by_start_time(df), 0
+    duplicated = pd.DataFrame({"key": np.concatenate(keys), "n": np.concatenate(occurrences)}).duplicated().to_numpy()
+    if duplicated.any():
+        df = df[~duplicated].reset_index(drop=True)
+    return sort_by_start_time(df), int(duplicated.sum())
+def _process_csv_bytes(file_bytes, agent_map):
+    """Process-pool worker: runs the ingest pipeline on one file's raw bytes."""
+    return read_call_data(io.BytesIO(file_bytes), agent_map=agent_map)
+def process_uploaded_files(uploaded_files, _on_progress=None):
+    """Processes several Digium exports in parallel and merges them into one frame.
+
+    Files already in the on-disk cache are loaded directly; the rest are parsed in a
+    process pool. The merged legs are in Start Time order. Returns (df, duplicates_dropped),
+    or (None, 0) if no file could be read.
+    """
+    agent_map = active_agent_map()
+    frames = [None] * len(uploaded_files)
+    pending = {}
+    for i, uploaded_file in enumerate(uploaded_files):
+        key = upload_cache_key(uploaded_file.getvalue())
+        frames[i] = load_cached_upload(key)
+        if frames[i] is None:
+            pending[i] = key
+    if len(pending) == 1:
+        # a single file isn't worth a pool; parse it here so the progress bar tracks it
+        i, key = next(iter(pending.items()))
+        try:
+            frames[i] = read_call_data(uploaded_files[i], on_progress=_on_progress, agent_map=agent_map)
+            store_cached_upload(key, frames[i])
+        except Exception as e:
+            st.error(f"Error reading {uploaded_files[i].name}: {e}")
+    elif pending:
+        # spawn, not fork: forking the threaded server would copy held locks into the workers
+        with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {
+                pool.submit(_process_csv_bytes, uploaded_files[i].getvalue(), agent_map): i
+                for i in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                try:
+                    frames[i] = future.result()
+                    store_cached_upload(pending[i], frames[i])
+                except Exception as e:
+                    st.error(f"Error reading {uploaded_files[i].name}: {e}")
+                if _on_progress is not None:
+                    _on_progress(done / len(pending))
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return None, 0
+    df, duplicates_dropped = merge_call_data(frames)
+    reports = [f.attrs["parse_report"] for f in frames if "parse_report" in f.attrs]
+    if reports:
+        df.attrs["parse_report"] = {
+            "engine": ", ".join(sorted({r["engine"] for r in reports})),
+            **{field: sum(r[field] for r in reports) for field in ["rows", "slow_rows", "dropped_rows"]},
+        }
+    return df, duplicates_dropped
+def append_call_data(df_existing, df_new):
+    """Appends a newly processed export onto an existing dataset.
+
+    Only new legs at or before the existing time watermark can already be loaded, and
+    they can only match existing legs from the same time window, so the overlap check
+    touches that window rather than the whole history. Legs are matched on (leg key,
+    occurrence) as in merge_call_data. Returns (df, new_legs, duplicates_dropped), where
+    new_legs holds just the appended legs for updating rollups and derived tables.
+    """
+    watermark = df_existing["Start Time"].max()
+    overlap = (df_new["Start Time"] <= watermark).to_numpy()
+    duplicated = np.zeros(len(df_new), dtype=bool)
+    if overlap.any():
+        window = df_existing[(df_existing["Start Time"] >= df_new["Start Time"].min()).to_numpy()]
+        window_key, new_key = leg_keys(window), leg_keys(df_new[overlap])
+        pairs = pd.DataFrame({
+            "key": np.concatenate([window_key, new_key]),
+            "n": np.concatenate([
+                pd.Series(window_key).groupby(window_key).cumcount().to_numpy(),
+                pd.Series(new_key).groupby(new_key).cumcount().to_numpy(),
+            ]),
+        })
+        duplicated[overlap] = pairs.duplicated().to_numpy()[len(window):]
+    df_new = df_new[~duplicated]
+    if df_new.empty:
+        return df_existing, df_new, int(duplicated.sum())
+    return sort_by_start_time(concat_call_data([df_existing, df_new])), df_new, int(duplicated.sum())
+def hold_range_labels(edges):
+    """Bin labels for hold time edges in seconds, e.g. "0–5 min" ... "30+ min"."""
+    minutes = [f"{edge / 60:g}" for edge in edges]
+    return [f"{lo}–{hi} min" for lo, hi in zip(minutes, minutes[1:])] + [f"{minutes[-1]}+ min"]
+def hold_histogram(seconds, edges=HOLD_BIN_EDGES, groups=None, n_groups=None):
+    """Counts of hold times per bin [edges[i], edges[i + 1]), the last bin open-ended.
+
+    Values below edges[0] and missing values are not counted, like pd.cut with
+    right=False. With groups (integer codes 0..n_groups-1, one per value) the result is an
+    (n_groups, bins) array of one histogram per group. Histograms of disjoint rows merge
+    by adding them.
+    """
+    seconds = np.asarray(seconds)
+    if seconds.dtype.kind == "f":
+        keep = ~np.isnan(seconds)
+        seconds = seconds[keep]
+        groups = None if groups is None else np.asarray(groups)[keep]
+    # searching edges of the values' own dtype avoids casting every value (an integer is
+    # >= edge exactly when it is >= ceil(edge)); slot 0 collects values below edges[0] and is dropped
+    edges = np.ceil(edges) if seconds.dtype.kind in "iu" else edges
+    slots = np.searchsorted(np.asarray(edges, dtype=seconds.dtype), seconds, side="right")
+    width = len(edges) + 1
+    if groups is None:
+        return np.bincount(slots, minlength=width)[1:]
+    counts = np.bincount(np.asarray(groups) * width + slots, minlength=n_groups * width)
+    return counts.reshape(n_groups, width)[:, 1:]
+def daily_hold_histograms(df, edges=HOLD_BIN_EDGES):
+    """Hold time histogram of each day in df: one row per Start Time date, one column per bin."""
+    day_codes, days = pd.factorize(df["Start Time"].dt.normalize(), sort=True)
+    counts = hold_histogram(df["Hold Time (s)"].to_numpy(), edges, day_codes, len(days))
+    return pd.DataFrame(counts, index=pd.DatetimeIndex(days, name="Date"), columns=hold_range_labels(edges))
+def build_call_rollups(df):
+    """Weekly and hourly call counts plus a per-day hold time histogram.
+
+    Every rollup is a sum of counts, so a new week is folded in with update_call_rollups
+    instead of rebuilding from the full history.
+    """
+    day = df["Start Time"].dt.normalize()
+    week_end = day + pd.to_timedelta((5 - day.dt.weekday) % 7, unit="D")  # Sunday–Saturday weeks
+    return {
+        "weekly": week_end.value_counts().sort_index().rename_axis("Week Ending"),
+        "hourly": df.groupby([day.rename("Date"), df["Hour"]]).size(),
+        "hold_hist": daily_hold_histograms(df),
+    }
+def update_call_rollups(rollups, df_new):
+    """Adds the rollups of newly appended legs onto existing rollups."""
+    if rollups is None:
+        return build_call_rollups(df_new)
+    new = build_call_rollups(df_new)
+    return {name: rollups[name].add(new[name], fill_value=0).astype("int64") for name in rollups}
+def hll_registers(values, groups, n_groups, precision=HLL_PRECISION):
+    """HyperLogLog registers of values, one (2**precision,) row per group code (0..n_groups-1).
+
+    Rows merge with np.maximum, so registers of days and queues combine into any range.
+    """
+    hashes = pd.util.hash_array(np.asarray(values))
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # rank = leading zeros of the remaining bits + 1; searchsorted over powers of two is an exact bit length
+    rank = (64 - precision + 1 - np.searchsorted(_POWERS_OF_TWO, rest, side="right")).astype(np.uint8)
+    registers = np.zeros(n_groups << precision, dtype=np.uint8)
+    np.maximum.at(registers, (np.asarray(groups) << precision) + index, rank)
+    return registers.reshape(n_groups, 1 << precision)
+def hll_estimate(registers):
+    """Distinct count estimated from HyperLogLog registers (last axis), with linear counting for small counts."""
+    m = registers.shape[-1]
+    raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-registers.astype(float)), axis=-1)
+    zeros = (registers == 0).sum(axis=-1)
+    return np.where((raw <= 2.5 * m) & (zeros > 0), m * np.log(m / np.maximum(zeros, 1)), raw)
+def sketch_quantiles(hist, quantiles):
+    """Quantiles (value at rank floor(q * (n - 1))) of a SKETCH_EDGES histogram, within SKETCH_RELATIVE_ACCURACY."""
+    total = hist.sum()
+    if total == 0:
+        return np.full(len(quantiles), np.nan)
+    slots = np.searchsorted(np.cumsum(hist), np.floor(np.asarray(quantiles) * (total - 1)), side="right")
+    # the point of [edge, edge * gamma) whose relative error is at most SKETCH_RELATIVE_ACCURACY either way
+    return np.where(slots == 0, 0.0, SKETCH_EDGES[slots] * 2 * SKETCH_GAMMA / (1 + SKETCH_GAMMA))
+def build_call_sketches(df):
+    """Mergeable per-day, per-queue sketches of df.
+
+    Returns a dict: "keys" (frame of Date, Queue ID and Legs, one row per sketched day and
+    queue), "hold" and "talk" (SKETCH_EDGES histograms of Hold Time (s) and Talk Time (s))
+    and "callers" and "call_ids" (HyperLogLog registers of From and Call ID), all row-aligned
+    with keys. SKETCH_ARRAYS says how each array merges.
+    """
+    grouped = pd.DataFrame({
+        "Date": df["Start Time"].dt.normalize(),
+        "Queue ID": df["Queue ID"].astype(str),
+    }).groupby(["Date", "Queue ID"], sort=True)
+    codes, n = grouped.ngroup().to_numpy(), grouped.ngroups
+    talk = df["Talk Time (s)"] if "Talk Time (s)" in df.columns else df["Talk Duration"]
+    return {
+        "keys": grouped.size().rename("Legs").reset_index(),
+        "hold": hold_histogram(df["Hold Time (s)"].to_numpy(), SKETCH_EDGES, codes, n).astype(np.int32),
+        "talk": hold_histogram(talk.to_numpy(), SKETCH_EDGES, codes, n).astype(np.int32),
+        "callers": hll_registers(df["From"].astype(str).to_numpy(dtype=object), codes, n),
+        "call_ids": hll_registers(df["Call ID"].to_numpy(), codes, n),
+    }
+def merge_call_sketches(sketches, other, keep_larger=False):
+    """Combines two sketch sets (see build_call_sketches).
+
+    Rows for the same day and queue are merged, which is right for sketches of different
+    legs (an appended week). With keep_larger the row that saw more legs wins instead, which
+    is right when both may have sketched the same legs (a re-uploaded export).
+    """
+    keys = pd.concat([sketches["keys"], other["keys"]], ignore_index=True)
+    arrays = {name: np.concatenate([sketches[name], other[name]]) for name in SKETCH_ARRAYS}
+    if keep_larger:
+        chosen = (keys.sort_values("Legs", kind="stable")
+                  .drop_duplicates(["Date", "Queue ID"], keep="last")
+                  .sort_values(["Date", "Queue ID"]).index.to_numpy())
+        return {"keys": keys.loc[chosen].reset_index(drop=True), **{name: a[chosen] for name, a in arrays.items()}}
+    grouped = keys.groupby(["Date", "Queue ID"], sort=True)
+    codes = grouped.ngroup().to_numpy()
+    merged = {"keys": grouped["Legs"].sum().reset_index()}
+    for name, ufunc in SKETCH_ARRAYS.items():
+        merged[name] = np.zeros((grouped.ngroups, arrays[name].shape[1]), dtype=arrays[name].dtype)
+        ufunc.at(merged[name], codes, arrays[name])
+    return merged
+def load_sketch_store(path=SKETCH_STORE_PATH):
+    """The sketches persisted by store_call_sketches, or None if there are none (or unreadable)."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            keys = pd.DataFrame({
+                "Date": data["date"].astype("datetime64[ns]"),
+                "Queue ID": data["queue"].astype(object),
+                "Legs": data["legs"],
+            })
+            return {"keys": keys, **{name: data[name] for name in SKETCH_ARRAYS}}
+    except (OSError, ValueError, KeyError):
+        return None
+_SKETCH_STORE_LOCK = threading.Lock()
+def store_call_sketches(sketches, path=SKETCH_STORE_PATH):
+    """Folds a dataset's sketches into the on-disk store that outlives the uploads.
+
+    A day and queue already stored is replaced only by a sketch that saw more legs, so
+    uploading the same export twice never double counts.
+    """
+    with _SKETCH_STORE_LOCK:
+        stored = load_sketch_store(path)
+        merged = sketches if stored is None else merge_call_sketches(stored, sketches, keep_larger=True)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a unique temp file first so a concurrent reader never sees a half-written file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    date=merged["keys"]["Date"].to_numpy().astype("datetime64[D]"),
+                    queue=merged["keys"]["Queue ID"].to_numpy(dtype=str),
+                    legs=merged["keys"]["Legs"].to_numpy(dtype=np.int64),
+                    **{name: merged[name] for name in SKETCH_ARRAYS},
+                )
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+@st.cache_resource(max_entries=1)
+def _sketch_store_snapshot(path, mtime_ns):
+    return load_sketch_store(path)
+def get_sketch_store(path=SKETCH_STORE_PATH):
+    """The persisted sketches, read once per change of the store file and shared read-only."""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return _sketch_store_snapshot(path, mtime_ns)
+def weekly_sketch_summary(sketches, start=None, queues=None, quantiles=(0.5, 0.9, 0.99)):
+    """Per Week Ending (Sunday–Saturday weeks): legs, hold time quantiles in minutes, distinct callers and calls.
+
+    Each week merges its day and queue sketches, so the cost is independent of how many
+    legs were sketched.
+    """
+    keys = sketches["keys"]
+    keep = np.ones(len(keys), dtype=bool)
+    if start is not None:
+        keep &= (keys["Date"] >= pd.Timestamp(start)).to_numpy()
+    if queues is not None:
+        keep &= keys["Queue ID"].isin([str(q) for q in queues]).to_numpy()
+    day = keys["Date"][keep]
+    codes, weeks = pd.factorize(day + pd.to_timedelta((5 - day.dt.weekday) % 7, unit="D"), sort=True)
+    merged = {}
+    for name, ufunc in SKETCH_ARRAYS.items():
+        merged[name] = np.zeros((len(weeks), sketches[name].shape[1]), dtype=sketches[name].dtype)
+        ufunc.at(merged[name], codes, sketches[name][keep])
+    summary = pd.DataFrame({
+        "Week Ending": weeks,
+        "Legs": np.bincount(codes, weights=keys["Legs"][keep].to_numpy(), minlength=len(weeks)).astype(np.int64),
+        "Unique Callers": np.rint(hll_estimate(merged["callers"])).astype(np.int64),
+        "Unique Calls": np.rint(hll_estimate(merged["call_ids"])).astype(np.int64),
+    })
+    percentiles = np.array([sketch_quantiles(hist, quantiles) for hist in merged["hold"]]).reshape(len(weeks), len(quantiles))
+    for i, q in enumerate(quantiles):
+        summary[f"p{q * 100:g} Hold (min)"] = percentiles[:, i] / 60
+    return summary
+def _extract_segments(calls, column, pattern):
+    """Regex matches of one segment column as rows of (Call ID, Ordinal, <pattern groups>)."""
+    found = calls[column].dropna().astype(str).str.extractall(pattern)
+    found.index.names = ["Call ID", "Ordinal"]
+    return found.reset_index()
+def build_segment_table(df):
+    """Parses Traversed, Hold Segments and Talk Segments into one row per segment.
+
+    Every leg of a call repeats the same three strings, so each call is parsed once.
+    Traversed gives the ordered path; the seconds spent in each queue (hold) or at each
+    extension (talk) come from the matching Hold/Talk Segments entry, paired up by
+    (node, occurrence) since a call can pass through the same queue twice. Returns
+    Call ID, Ordinal, Kind, Node and Seconds, sorted by call and ordinal.
+    """
+    columns = ["Call ID", "Ordinal", "Kind", "Node", "Seconds"]
+    if df is None or "Traversed" not in df.columns:
+        return pd.DataFrame(columns=columns)
+    calls = df.drop_duplicates("Call ID").set_index("Call ID")
+    path = _extract_segments(calls, "Traversed", SEGMENT_PATTERNS["Traversed"])
+    keys = ["Call ID", "Kind", "Node"]
+    path["n"] = path.groupby(keys).cumcount()
+    timed = [
+        _extract_segments(calls, column, SEGMENT_PATTERNS[column]).drop(columns="Ordinal").assign(Kind=kind)
+        for column, kind in (("Hold Segments", "Queue"), ("Talk Segments", "Extension"))
+        if column in calls.columns
+    ]
+    if timed:
+        timed = pd.concat(timed, ignore_index=True)
+        timed["n"] = timed.groupby(keys).cumcount()
+        path = path.merge(timed, on=keys + ["n"], how="left")
+    else:
+        path["Seconds"] = 0
+    return pd.DataFrame({
+        "Call ID": path["Call ID"].astype("int64"),
+        "Ordinal": path["Ordinal"].astype("int32"),
+        "Kind": path["Kind"].astype(pd.CategoricalDtype(SEGMENT_KINDS)),
+        "Node": path["Node"].astype(str).astype("category"),
+        "Seconds": pd.to_numeric(path["Seconds"], errors="coerce").fillna(0).astype("int32"),
+    }).sort_values(["Call ID", "Ordinal"], ignore_index=True)
+def update_segment_table(segments, df_new):
+    """Adds segments for the calls in newly appended legs that aren't parsed yet."""
+    if segments is None or segments.empty:
+        return build_segment_table(df_new)
+    df_new = df_new[~df_new["Call ID"].isin(segments["Call ID"].unique())]
+    if df_new.empty:
+        return segments
+    return concat_call_data([segments, build_segment_table(df_new)])
+def build_call_table(df):
+    """Collapses call legs into one row per call.
+
+    A call that moves between queues appears once per queue leg, each leg repeating the
+    call-level columns. The table keeps the first Start Time, hold and talk seconds summed
+    over the legs, the call's Talk Duration once, the leg count, the last extension that
+    picked up, whether the call was abandoned and its queue path in leg order.
+    """
+    legs = df.sort_values("Call ID", kind="stable")
+    grouped = legs.groupby("Call ID", sort=False)
+    aggregations = {
+        "Start Time": ("Start Time", "min"),
+        "Hold Time (s)": ("Hold Time (s)", "sum"),
+        "Talk Duration": ("Talk Duration", "first"),
+        "Legs": ("Call ID", "size"),
+        "Abandoned": ("Abandoned", "any"),
+    }
+    if "Talk Time (s)" in legs.columns:
+        aggregations["Talk Time (s)"] = ("Talk Time (s)", "sum")
+    calls = grouped.agg(**aggregations)
+    # legs that never reached an extension carry "nan"; groupby last skips them
+    extension = legs["Extension"].astype(str)
+    calls["Final Extension"] = extension.where(~extension.isin(["nan", ""])).groupby(legs["Call ID"], sort=False).last()
+    # Queue path: one column per leg position, joined left to right
+    by_leg = pd.DataFrame({
+        "Call ID": legs["Call ID"].to_numpy(),
+        "Leg": grouped.cumcount().to_numpy(),
+        "Queue ID": legs["Queue ID"].astype(str).to_numpy(),
+    }).pivot(index="Call ID", columns="Leg", values="Queue ID")
+    path = by_leg[0] if len(by_leg.columns) else pd.Series(index=by_leg.index, dtype=object)
+    for leg in by_leg.columns[1:]:
+        path = path.where(by_leg[leg].isna(), path + " > " + by_leg[leg])
+    calls["Queue Path"] = path
+    return calls.reset_index().astype({
+        "Hold Time (s)": "int32",
+        "Talk Duration": "int32",
+        "Legs": "int32",
+        "Abandoned": "boolean",
+        "Final Extension": "category",
+        "Queue Path": "category",
+        **({"Talk Time (s)": "int32"} if "Talk Time (s)" in calls.columns else {}),
+    })
+def update_call_table(calls, df, df_new):
+    """Rebuilds the rows of calls that newly appended legs belong to; df is the combined dataset."""
+    if calls is None:
+        return build_call_table(df)
+    touched = df_new["Call ID"].unique()
+    kept = calls[~calls["Call ID"].isin(touched).to_numpy()]
+    return concat_call_data([kept, build_call_table(df[df["Call ID"].isin(touched).to_numpy()])])
+def get_call_table(df):
+    """Call-grain rows aggregated over the legs in df only.
+
+    Calls with every leg in df are read from the table built at upload; calls that the
+    filters cut down to some of their legs are rebuilt from the legs that remain.
+    """
+    entry = get_dataset()
+    calls = None if entry is None else entry.get("calls")
+    if calls is None:
+        return build_call_table(df)
+    legs = df["Call ID"].value_counts(sort=False)
+    kept = calls[calls["Call ID"].isin(legs.index).to_numpy()]
+    whole = (kept["Legs"].to_numpy() == legs.reindex(kept["Call ID"]).to_numpy())
+    if whole.all():
+        return kept
+    partial = df[~df["Call ID"].isin(kept["Call ID"][whole]).to_numpy()]
+    return concat_call_data([kept[whole], build_call_table(partial)])
+def _segment_nodes(segments):
+    """Integer node code per segment and the node labels ("Queue 807", "Extension 119")."""
+    kind_codes, kinds = pd.factorize(segments["Kind"])
+    node_codes, node_names = pd.factorize(segments["Node"])
+    node_keys, codes = np.unique(node_codes.astype(np.int64) * len(kinds) + kind_codes, return_inverse=True)
+    nodes = pd.Index(kinds.astype(str)[node_keys % len(kinds)] + " " + node_names.astype(str)[node_keys // len(kinds)])
+    return codes.ravel(), nodes
+def build_transfer_graph(segments, top_k=TRANSFER_TOP_PATHS):
+    """Where calls flow between queues and extensions, from the segment table.
+
+    Every queue and extension becomes an integer node ("Queue 807", "Extension 119").
+    Consecutive segments of a call are a hop; hops are counted per (source, target) pair,
+    i.e. the non-zero cells of the transition matrix, with the hold seconds spent in the
+    target queue summed per pair. Whole paths are compared as rows of node codes and the
+    top_k most frequent are labelled. Returns a dict: "nodes", "edges" (Source, Target,
+    Transfers, Hold (s), Avg Hold (s)) and "paths" (Path, Calls, Share (%), Avg Hold (s)).
+    """
+    if segments.empty:
+        return {"nodes": pd.Index([]),
+                "edges": pd.DataFrame(columns=["Source", "Target", "Transfers", "Hold (s)", "Avg Hold (s)"]),
+                "paths": pd.DataFrame(columns=["Path", "Calls", "Share (%)", "Avg Hold (s)"])}
+    codes, nodes = _segment_nodes(segments)
+    call_ids = segments["Call ID"].to_numpy()
+    hold = np.where((segments["Kind"] == "Queue").to_numpy(), segments["Seconds"].to_numpy(), 0)
+    same_call = call_ids[1:] == call_ids[:-1]
+    source, target = codes[:-1][same_call], codes[1:][same_call]
+    pairs, pair_codes = np.unique(source.astype(np.int64) * len(nodes) + target, return_inverse=True)
+    transfers = np.bincount(pair_codes, minlength=len(pairs))
+    edge_hold = np.bincount(pair_codes, weights=hold[1:][same_call], minlength=len(pairs))
+    edges = pd.DataFrame({
+        "Source": nodes[pairs // max(len(nodes), 1)],
+        "Target": nodes[pairs % max(len(nodes), 1)],
+        "Transfers": transfers,
+        "Hold (s)": edge_hold.astype(np.int64),
+        "Avg Hold (s)": edge_hold / np.maximum(transfers, 1),
+    }).sort_values("Transfers", ascending=False, ignore_index=True)
+
+    # one row of node codes per call, padded with -1, so equal paths are equal rows
+    first = np.r_[True, ~same_call]
+    call_index = np.cumsum(first) - 1
+    position = np.arange(len(codes)) - np.flatnonzero(first)[call_index]
+    grid = np.full((first.sum(), position.max(initial=-1) + 1), -1, dtype=np.int32)
+    grid[call_index, position] = codes
+    order = np.lexsort(grid.T[::-1])
+    grid = grid[order]
+    new_path = np.r_[True, (grid[1:] != grid[:-1]).any(axis=1)]
+    rows = grid[new_path]
+    path_codes = np.empty(len(grid), dtype=np.int64)
+    path_codes[order] = np.cumsum(new_path) - 1
+    calls = np.bincount(path_codes, minlength=len(rows))
+    path_hold = np.bincount(path_codes, weights=np.bincount(call_index, weights=hold, minlength=len(grid)), minlength=len(rows))
+    top = np.argsort(-calls, kind="stable")[:top_k]
+    paths = pd.DataFrame({
+        "Path": [" → ".join(nodes[row[row >= 0]]) for row in rows[top]],
+        "Calls": calls[top],
+        "Share (%)": calls[top] / max(len(grid), 1) * 100,
+        "Avg Hold (s)": path_hold[top] / calls[top],
+    })
+    return {"nodes": nodes, "edges": edges, "paths": paths}
+def get_transfer_graph(df):
+    """Transfer graph of the calls in df, memoized per filter signature like get_call_kpis."""
+    entry = get_dataset()
+    segments = None if entry is None else entry.get("segments")
+    if segments is None:
+        return build_transfer_graph(build_segment_table(df))
+    build = lambda: build_transfer_graph(segments[segments["Call ID"].isin(df["Call ID"].unique()).to_numpy()])
+    key = filtered_view_key(df)
+    if key is None:
+        return build()
+    return _dataset_memo(entry, "transfers", key, build)
+def caller_numbers(values):
+    """Caller number per From value as int64 ("Return-ANSONVILLE NC <+17048264062>" -> 7048264062), -1 if none.
+
+    Each distinct From string is parsed once. REPEAT_EXCLUDED_NUMBERS also map to -1.
+    """
+    codes, uniques = pd.factorize(values)
+    digits = pd.Series(uniques.astype(str)).str.extract(r"<\+?(\d+)>", expand=False)
+    digits = digits.where(~((digits.str.len() == 11) & digits.str.startswith("1")), digits.str[1:])
+    numbers = pd.to_numeric(digits, errors="coerce").fillna(-1).astype(np.int64).to_numpy()
+    numbers[np.isin(numbers, REPEAT_EXCLUDED_NUMBERS)] = -1
+    # code -1 (missing From) reads the trailing -1
+    return np.append(numbers, -1)[codes]
+def build_repeat_calls(df, windows=REPEAT_WINDOWS):
+    """One row per call with the gaps to the same caller's previous and next calls.
+
+    Calls are sorted by (caller number, first Start Time) once; the gap to the neighbouring
+    call of the same number comes from a diff. For each window label and length in
+    seconds, "Repeat (<label>)" marks calls made within the window after the caller's
+    previous call and "Called Back (<label>)" calls followed by another within the window.
+    Calls without a caller number are never flagged.
+    """
+    calls = df.sort_values("Start Time", kind="stable").drop_duplicates("Call ID")
+    number = caller_numbers(calls["From"])
+    start = calls["Start Time"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    order = np.lexsort((start, number))
+    same = (number[order][1:] == number[order][:-1]) & (number[order][1:] >= 0)
+    gap = np.where(same, np.diff(start[order]), np.inf)
+    since = np.full(len(calls), np.inf)
+    until = np.full(len(calls), np.inf)
+    since[order[1:]] = gap
+    until[order[:-1]] = gap
+    repeats = pd.DataFrame({
+        "Call ID": calls["Call ID"].to_numpy(),
+        "Caller": number,
+        "Start Time": calls["Start Time"].to_numpy(),
+        "Seconds Since Last Call": since,
+        "Seconds Until Next Call": until,
+    })
+    for label, seconds in windows.items():
+        repeats[f"Repeat ({label})"] = since <= seconds
+        repeats[f"Called Back ({label})"] = until <= seconds
+    return repeats.sort_values("Call ID", ignore_index=True)
+def get_repeat_calls(df):
+    """Repeat flags (see build_repeat_calls) among the calls in df, memoized like get_call_kpis.
+
+    Only calls in df are compared, so a call repeats another only when both pass the
+    sidebar filters and every rate is taken over the same filtered calls.
+    """
+    key = filtered_view_key(df)
+    if key is None:
+        return build_repeat_calls(df)
+    return _dataset_memo(get_dataset(), "repeats", key, lambda: build_repeat_calls(df))
+def repeat_rates(df, repeats, by):
+    """Calls and % repeat / called back per window for each value of by (e.g. Queue ID, Call Category).
+
+    A call counts once in every group its legs fall into.
+    """
+    calls = df[["Call ID", by]].drop_duplicates()
+    found = pd.Index(repeats["Call ID"]).get_indexer(calls["Call ID"])
+    flags = [col for col in repeats.columns if col.startswith(("Repeat (", "Called Back ("))]
+    rows = repeats[flags].to_numpy()[found] & (found >= 0)[:, None]
+    grouped = pd.DataFrame(rows * 100.0, columns=[f"% {col}" for col in flags]).groupby(calls[by].to_numpy(), observed=True)
+    rates = grouped.mean()
+    rates.insert(0, "Calls", grouped.size())
+    return rates.rename_axis(by).reset_index()
+def build_path_index(segments):
+    """Inverted index from queue/extension to the calls whose path passes through it.
+
+    Calls are numbered in Call ID order and every segment is keyed call number * width +
+    position in the path. Keys are grouped by node (see _segment_nodes) and sorted, one
+    slice of "keys" per node between "offsets"[node] and "offsets"[node + 1], so any node's
+    occurrences are a sorted int64 array ready for searchsorted and set intersection.
+    """
+    codes, nodes = _segment_nodes(segments)
+    calls, call_index = np.unique(segments["Call ID"].to_numpy(), return_inverse=True)
+    position = segments["Ordinal"].to_numpy(dtype=np.int64)
+    width = int(position.max(initial=0)) + 1
+    keys = call_index.ravel().astype(np.int64) * width + position
+    order = np.lexsort((keys, codes))
+    offsets = np.searchsorted(codes[order], np.arange(len(nodes) + 1))
+    return {"calls": calls, "nodes": nodes, "width": width, "keys": keys[order], "offsets": offsets}
+def get_path_index():
+    """Path index of the loaded dataset's segment table, built once per dataset; None without segments."""
+    entry = get_dataset()
+    if entry is None or entry.get("segments") is None:
+        return None
+    return _dataset_table(entry, "path_index", lambda: build_path_index(entry["segments"]))
+def query_routes(path_index, nodes, ordered=True):
+    """Sorted Call IDs whose path contains every node, in the given order if ordered.
+
+    Ordered queries walk the nodes left to right, moving each call to the earliest
+    occurrence of the next node after its current position (one searchsorted per step);
+    unordered ones intersect the nodes' call sets.
+    """
+    codes = path_index["nodes"].get_indexer(list(nodes))
+    if len(codes) == 0:
+        return path_index["calls"]
+    if (codes < 0).any():
+        return path_index["calls"][:0]
+    keys, offsets, width = path_index["keys"], path_index["offsets"], path_index["width"]
+    postings = [keys[offsets[code]:offsets[code + 1]] for code in codes]
+    # postings are sorted, so a call's occurrences are adjacent and its first one leads
+    firsts = [posting[np.r_[True, posting[1:] // width != posting[:-1] // width]] for posting in postings]
+    if not ordered:
+        found = firsts[0] // width
+        for first in firsts[1:]:
+            found = np.intersect1d(found, first // width, assume_unique=True)
+        return path_index["calls"][found]
+    current = firsts[0]
+    for posting in postings[1:]:
+        following = np.searchsorted(posting, current + 1)
+        found = following < len(posting)
+        current, following = current[found], following[found]
+        nxt = posting[following]
+        current = nxt[nxt // width == current // width]
+    return path_index["calls"][current // width]
+def _cube_merge(column):
+    """How a cube cell column combines when cells are merged."""
+    measure, _, stat = column.rpartition(" ")
+    return stat if measure in CUBE_MEASURES and stat in ("min", "max") else "sum"
+def build_call_cube(df):
+    """Pre-aggregates call legs into cells keyed by CUBE_DIMENSIONS.
+
+    Each cell holds "Legs", and for every CUBE_MEASURES column "<measure> sum", "sumsq",
+    "min" and "max", plus a hold time histogram over HOLD_BIN_EDGES (one column per
+    HOLD_RANGE_LABELS). Cells merge by adding (min/max by taking the min/max), so they roll
+    up to any coarser grouping and new weeks fold in with update_call_cube.
+    """
+    measures = [m for m in CUBE_MEASURES if m in df.columns]
+    cells = {col: df[col] for col in CUBE_DIMENSIONS[1:]}
+    cells["Date"] = df["Start Time"].dt.normalize()
+    cells["Legs"] = np.ones(len(df), dtype=np.int64)
+    for measure in measures:
+        values = df[measure].to_numpy(dtype=np.int64)
+        cells.update({f"{measure} sum": values, f"{measure} sumsq": values * values,
+                      f"{measure} min": values, f"{measure} max": values})
+    cells = pd.DataFrame(cells)
+    values = [col for col in cells.columns if col not in CUBE_DIMENSIONS]
+    # dropna=False keeps legs with no agent or queue in the totals of every other grouping
+    grouped = cells.groupby(CUBE_DIMENSIONS, observed=True, sort=False, dropna=False)
+    cube = grouped.agg({col: _cube_merge(col) for col in values}).reset_index()
+    # ngroup numbers cells in the same order as the aggregated rows
+    hold_hist = hold_histogram(df["Hold Time (s)"].to_numpy(), groups=grouped.ngroup().to_numpy(), n_groups=len(cube))
+    cube[HOLD_RANGE_LABELS] = hold_hist
+    return cube
+def update_call_cube(cube, df_new):
+    """Merges the cells of newly appended legs into an existing cube."""
+    if cube is None:
+        return build_call_cube(df_new)
+    cells = concat_call_data([cube, build_call_cube(df_new)])
+    values = [col for col in cells.columns if col not in CUBE_DIMENSIONS]
+    return (cells.groupby(CUBE_DIMENSIONS, observed=True, sort=False, dropna=False)
+            .agg({col: _cube_merge(col) for col in values}).reset_index())
+def build_dataset(df, **attrs):
+    """A registry entry for a freshly loaded frame: the frame plus the tables derived from it."""
+    return {
+        "df": df,
+        "segments": build_segment_table(df),
+        "calls": build_call_table(df),
+        "cube": build_call_cube(df),
+        "sketches": build_call_sketches(df),
+        "rollups": build_call_rollups(df),
+        "memory_report": memory_report(df),
+        **attrs,
+    }
+def derive_dataset(entry, **changes):
+    """A new entry from an existing one with some tables replaced; lazily built tables (filter index, KPIs, ...) are rebuilt on first use."""
+    return {**{k: v for k, v in entry.items() if k not in ("filter_index", "path_index", "kpis", "concurrency", "staffing", "transfers", "repeats", "automation_wait", "views", "last_used")}, **changes}
+def dataset_key(*parts):
+    """Content address of a dataset, from the hashes of what it was built from (files, agent map, appends)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8") + b"\0")
+    return digest.hexdigest()
+def agent_map_fingerprint(agent_map):
+    """Short stable fingerprint of an agent map (plain dict or dated frame)."""
+    if isinstance(agent_map, pd.DataFrame):
+        return hashlib.sha256(pd.util.hash_pandas_object(agent_map, index=False).to_numpy().tobytes()).hexdigest()[:16]
+    items = sorted((str(ext), str(name)) for ext, name in agent_map.items())
+    return hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()[:16]
+@st.cache_resource
+def _dataset_registry():
+    """Datasets loaded by any session, shared process-wide: {key: entry} behind a lock."""
+    return {"lock": threading.Lock(), "datasets": {}}
+def _evict_idle_datasets(registry, max_idle=DATASET_IDLE_MINUTES * 60):
+    cutoff = time.monotonic() - max_idle
+    for key in [key for key, entry in registry["datasets"].items() if entry["last_used"] < cutoff]:
+        del registry["datasets"][key]
+def register_dataset(key, entry):
+    """Publishes a dataset entry under key and returns the stored entry.
+
+    If another session already registered the same key its entry is kept, so sessions that
+    load the same files share one set of frames. Entries are read-only once registered;
+    appends and agent remaps register a derived entry under a new key instead.
+    """
+    registry = _dataset_registry()
+    with registry["lock"]:
+        _evict_idle_datasets(registry)
+        entry = registry["datasets"].setdefault(key, entry)
+        entry["last_used"] = time.monotonic()
+    return entry
+def get_dataset(key=None):
+    """The registry entry for key (default: this session's 'dataset_key' handle), or None if not loaded.
+
+    Every lookup counts as a use, so a dataset stays loaded while any session is reading it.
+    """
+    key = st.session_state.get('dataset_key') if key is None else key
+    if key is None:
+        return None
+    registry = _dataset_registry()
+    with registry["lock"]:
+        _evict_idle_datasets(registry)
+        entry = registry["datasets"].get(key)
+        if entry is not None:
+            entry["last_used"] = time.monotonic()
+    return entry
+def _dataset_table(entry, name, build):
+    """entry[name], built by build() on first use.
+
+    Entries are shared by every session's thread, so the table is built outside the registry
+    lock and published with one atomic setdefault: sessions racing to build it all use the
+    copy that was stored first, and nobody sees a partly built value.
+    """
+    table = entry.get(name)
+    return table if table is not None else entry.setdefault(name, build())
+def _dataset_memo(entry, name, key, build, max_entries=KPI_CACHE_SIZE):
+    """build() memoized under key in the shared dict entry[name], keeping the max_entries latest keys.
+
+    The value is built outside the registry lock; storing it and evicting old keys happen
+    under the lock, so concurrent sessions never trim the dict while another writes to it.
+    """
+    value = entry.get(name, {}).get(key)
+    if value is None:
+        value = build()
+        with _dataset_registry()["lock"]:
+            cache = entry.setdefault(name, {})
+            value = cache.setdefault(key, value)
+            for stale in list(cache)[:-max_entries]:
+                cache.pop(stale)
+    return value
+def get_original_df():
+    """This session's loaded call data, or None."""
+    entry = get_dataset()
+    return None if entry is None else entry["df"]
 def load_agent_mapping_from_file(uploaded_file):
-    """Reads an agent mapping XLSX and returns a dictionary."""
+    """Reads an agent mapping XLSX, parsing each distinct file once.
+
+    Columns are Extension and Agent Name, optionally followed by Effective From and
+    Effective To dates for extensions that were reassigned. Without dates the result is an
+    {extension: name} dictionary; with them, a frame of AGENT_MAP_COLUMNS, one row per period.
+    """
     if uploaded_file is None:
         return None
+    file_bytes = uploaded_file.getvalue()
+    return _parse_agent_mapping(hashlib.sha256(file_bytes).hexdigest(), file_bytes)
+@st.cache_data
+def _parse_agent_mapping(digest, _file_bytes):
+    """Parses a mapping file; cached on the content digest so the bytes aren't rehashed on every rerun."""
     try:
         # Read the XLSX file
-        map_df = pd.read_excel(uploaded_file)
-        map_df.columns = ['Extension', 'AgentName']
+        map_df = pd.read_excel(io.BytesIO(_file_bytes))
+        map_df = map_df.iloc[:, :len(AGENT_MAP_COLUMNS)]
+        map_df.columns = AGENT_MAP_COLUMNS[:map_df.shape[1]]
         map_df['Extension'] = pd.to_numeric(map_df['Extension'], errors='coerce')
         map_df = map_df.dropna(subset=['Extension'])
         map_df['Extension'] = map_df['Extension'].astype(int)
+        dates = [col for col in AGENT_MAP_COLUMNS[2:] if col in map_df.columns]
+        if dates and map_df[dates].notna().any().any():
+            periods = map_df.reindex(columns=AGENT_MAP_COLUMNS)
+            for col in AGENT_MAP_COLUMNS[2:]:
+                periods[col] = pd.to_datetime(periods[col], errors='coerce')
+            return periods.reset_index(drop=True)
         # Directly convert to dictionary without writing/reading temp file
         return pd.Series(map_df['AgentName'].values, index=map_df['Extension']).to_dict()
     except Exception as e:
         st.error(f"Error reading agent mapping file: {e}")
         return None
 # --- 3. Global Sidebar Function ---
+def build_filter_index(df):
+    """Precomputes what the sidebar filters need so a selection resolves without rescanning the frame.
+
+    Rows are put in Start Time order once (order maps back to positions in df), each row gets
+    an int32 day number so a date range is a searchsorted slice, and every other filter
+    dimension is kept as categorical codes so a selection is a boolean lookup by code. The
+    index is shared read-only by every session on the dataset; each session's masks and last
+    selection live in its own cache (see filter_rows).
+    """
+    start = df["Start Time"].to_numpy()
+    order = None
+    if not df["Start Time"].is_monotonic_increasing:
+        order = np.argsort(start, kind="stable").astype(np.int32 if len(df) < 2**31 else np.int64)
+        start = start[order]
+    index = {
+        "source": df,
+        "order": order,
+        "day": start.astype("datetime64[D]").astype(np.int64).astype(np.int32),
+        "codes": {},
+        "categories": {},
+        "options": {},
+    }
+    for col in FILTER_DIMENSIONS:
+        values = pd.Categorical(df[col])
+        index["codes"][col] = values.codes if order is None else values.codes[order]
+        index["categories"][col] = values.categories
+        present = np.bincount(values.codes[values.codes >= 0], minlength=len(values.categories)) > 0
+        index["options"][col] = sorted(values.categories[present])
+    return index
+def get_filter_index(df):
+    """The filter index for df, built once per registered dataset and shared by its sessions."""
+    entry = get_dataset()
+    if entry is None or entry["df"] is not df:
+        return build_filter_index(df)
+    return _dataset_table(entry, "filter_index", lambda: build_filter_index(df))
+def _dimension_mask(index, col, selected, masks):
+    """Row mask (in time order) for one dimension's selection, or None when nothing is excluded."""
+    key = tuple(sorted(map(str, selected)))
+    cached = masks.get(col)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # code -1 (missing) reads the trailing False, matching isin
+    lookup = np.append(index["categories"][col].isin(selected), False)
+    mask = None if lookup[:-1].all() and (index["codes"][col] >= 0).all() else lookup[index["codes"][col]]
+    masks[col] = (key, mask)
+    return mask
+def filter_signature(start_date, end_date, selections, route=None):
+    """Hashable, order-insensitive key of a sidebar filter state (route, if any, keeps its order)."""
+    route = None if not route or not route[0] else (tuple(route[0]), bool(route[1]))
+    return (start_date, end_date, tuple((col, tuple(sorted(map(str, v)))) for col, v in selections.items()), route)
+def _leg_call_codes(index, path_index):
+    """Each leg's call number (in time order) in the path index, -1 for calls without segments."""
+    calls = path_index["calls"]
+    call_ids = index["source"]["Call ID"].to_numpy()
+    if index["order"] is not None:
+        call_ids = call_ids[index["order"]]
+    codes = np.searchsorted(calls, call_ids)
+    found = (codes < len(calls)) & (np.append(calls, 0)[codes] == call_ids)
+    return np.where(found, codes, -1)
+def _route_mask(index, path_index, route, masks):
+    """Row mask (in time order) of the legs whose call matches route, a (nodes, ordered) pair."""
+    cached = masks.get("Route")
+    if cached is not None and cached[0] == route:
+        return cached[1]
+    calls = path_index["calls"]
+    call_codes = _dataset_table(index, "call_codes", lambda: _leg_call_codes(index, path_index))
+    # code -1 reads the trailing False
+    matched = np.zeros(len(calls) + 1, dtype=bool)
+    matched[np.searchsorted(calls, query_routes(path_index, *route))] = True
+    mask = matched[call_codes]
+    masks["Route"] = (route, mask)
+    return mask
+def filter_rows(index, start_date, end_date, selections, route=None, path_index=None, cache=None):
+    """Positions in the indexed frame of the rows inside [start_date, end_date] matching every selection.
+
+    selections maps a FILTER_DIMENSIONS column to the labels to keep. route, a (nodes,
+    ordered) pair, further keeps the legs of calls whose path matches (see query_routes).
+    Positions are ascending, so the rows keep the frame's own order. cache is a dict owned
+    by the caller (the sidebar keeps one per session) that remembers the per-dimension masks
+    and the last selection between calls.
+    """
+    cache = {} if cache is None else cache
+    masks = cache.setdefault("masks", {})
+    signature = filter_signature(start_date, end_date, selections, route)
+    route = signature[3] if path_index is not None else None
+    if cache.get("selection") is not None and cache["selection"][0] == signature:
+        return cache["selection"][1]
+    day = index["day"]
+    bounds = np.array([np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1]).astype(np.int64)
+    lo, hi = np.searchsorted(day, bounds, side="left")
+    keep = None
+    for col, selected in selections.items():
+        mask = _dimension_mask(index, col, selected, masks)
+        if mask is None:
+            continue
+        keep = mask[lo:hi].copy() if keep is None else np.logical_and(keep, mask[lo:hi], out=keep)
+    if route is not None:
+        mask = _route_mask(index, path_index, route, masks)
+        keep = mask[lo:hi].copy() if keep is None else np.logical_and(keep, mask[lo:hi], out=keep)
+    dtype = np.int32 if len(day) < 2**31 else np.int64
+    if index["order"] is None:
+        positions = np.arange(lo, hi, dtype=dtype) if keep is None else (lo + np.flatnonzero(keep)).astype(dtype)
+    else:
+        # scatter back through order into a frame-order bitmap; linear, unlike sorting the positions
+        selected = np.zeros(len(day), dtype=bool)
+        selected[index["order"][lo:hi] if keep is None else index["order"][lo:hi][keep]] = True
+        positions = np.flatnonzero(selected).astype(dtype)
+    cache["selection"] = (signature, positions)
+    return positions
+def get_filtered_df():
+    """The calls matching the sidebar filters, or None before any data is loaded.
+
+    Sessions keep only the selected row positions (st.session_state['filter_rows'], None
+    meaning every row) over the shared original. The frame is materialized on first use and
+    memoized in the dataset entry under the filter signature, so sessions with the same
+    filters share one copy and only the VIEW_CACHE_SIZE latest filter states are kept.
+    Treat the result as read-only.
+    """
+    entry = get_dataset()
+    if entry is None:
+        return None
+    df = entry["df"]
+    rows = st.session_state.get('filter_rows')
+    if rows is None or len(rows) == len(df):
+        return df
+    return _dataset_memo(entry, "views", st.session_state.get('filter_signature'), lambda: df.take(rows),
+                         max_entries=VIEW_CACHE_SIZE)
+def filtered_view_key(df):
+    """Cache key for tables derived from df, or None unless df holds exactly the session's filtered rows.
+
+    df may be the view from get_filtered_df or an equal copy of it (same rows, same index).
+    The key is the sidebar filter signature, or "all" when no rows are filtered out.
+    """
+    entry = get_dataset()
+    view = get_filtered_df()
+    if entry is None or view is None or df is None:
+        return None
+    if df is not view and (len(df) != len(view) or not df.index.equals(view.index)):
+        return None
+    return "all" if view is entry["df"] else st.session_state.get('filter_signature')
+def get_cube_cells(df):
+    """The cube cells (see build_call_cube) behind df, or None if df is not backed by the cube.
+
+    Only the loaded frame and the session's filtered view are: the sidebar filters map onto
+    cube dimensions, so the view's cells are picked from its filter signature without
+    touching the legs. Callers scan df themselves when this returns None.
+    """
+    entry = get_dataset()
+    if entry is None or entry.get("cube") is None:
+        return None
+    cube = entry["cube"]
+    if df is entry["df"]:
+        return cube
+    signature = st.session_state.get('filter_signature')
+    if signature is None or df is not get_filtered_df():
+        return None
+    start_date, end_date, selections, route = signature
+    if route is not None:
+        return None  # routes are not a cube dimension
+    keep = cube["Date"].between(pd.Timestamp(start_date), pd.Timestamp(end_date)).to_numpy()
+    for col, labels in selections:
+        keep &= cube[col].isin(labels).to_numpy()
+    return cube[keep]
+def cube_aggregate(cells, dims, measures, how):
+    """df.groupby(dims).agg(how) of measures, answered from cube cells, plus a "Legs" count.
+
+    how is one of CUBE_AGGREGATIONS; mean and std come from the sums and sums of squares.
+    """
+    groups = cells.groupby(dims, observed=True)
+    legs = groups["Legs"].sum()
+    result = {}
+    for measure in measures:
+        if how == "count":
+            result[measure] = legs
+        elif how in ("sum", "min", "max"):
+            result[measure] = groups[f"{measure} {how}"].agg(how)
+        else:
+            total = groups[f"{measure} sum"].sum().astype(float)
+            if how == "mean":
+                result[measure] = total / legs
+            else:
+                n = legs.astype(float)
+                variance = (groups[f"{measure} sumsq"].sum() - total * total / n) / (n - 1)
+                result[measure] = np.sqrt(variance.clip(lower=0)).where(n > 1)
+    result["Legs"] = legs
+    return pd.DataFrame(result).reset_index()
 def reset_filters(df):  
     """Resets all filters to their default state."""
-    st.session_state['df_filtered'] = df.copy()  # Reset to original data
+    st.session_state['filter_rows'] = None  # Reset to original data
     st.session_state['filter_selections'] = {
         "Date Range": (df["Start Time"].min().strftime('%Y-%m-%d'), df["Start Time"].max().strftime('%Y-%m-%d')),
         "Days": ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
@@ -151,19 +1611,20 @@ def create_global_sidebar():
     )
 
     # Only show filters if data has been uploaded and processed
-    if 'df_original' not in st.session_state or st.session_state['df_original'] is None or st.session_state['df_original'].empty:
+    df = get_original_df()
+    if df is None or df.empty:
         st.sidebar.warning("Upload Digium call data on the Home page to activate filters.")
-        st.session_state['df_filtered'] = pd.DataFrame()  # Ensure filtered df exists
+        st.session_state['filter_rows'] = None
         return
 
     st.sidebar.header("Global Filter Options")
-    df = st.session_state['df_original']
+    index = get_filter_index(df)
     st.sidebar.button("Reset Filters", on_click=lambda: reset_filters(df))
     st.sidebar.button("Apply New")
     # --- Collect all filter values from widgets ---
     start_date, end_date = st.sidebar.date_input(
         "Date Range",
-        value=(df["Start Time"].min().date(), df["Start Time"].max().date())
+        value=tuple(np.datetime64(int(index["day"][i]), "D").astype(object) for i in (0, -1))
     )
     days_opts = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday', 'Weekends Only']
     selected_days = st.sidebar.multiselect(
@@ -173,8 +1634,8 @@ def create_global_sidebar():
     )
     selected_shifts = st.sidebar.multiselect(
         "Filter by Shift",
-        options=sorted(df["Shift"].unique()),
-        default=sorted(df["Shift"].unique())
+        options=index["options"]["Shift"],
+        default=index["options"]["Shift"]
     )
     # Add Returned Automation as a separate filter section
     st.sidebar.markdown("### Returned Automation Calls")
@@ -185,7 +1646,7 @@ def create_global_sidebar():
     )
 
     # Category filter
-    category_options = sorted(df["Call Category"].unique())
+    category_options = index["options"]["Call Category"]
     # Always include 'Returned Automation' in default if present
     default_categories = [cat for cat in ['Automation', 'Returned Automation'] if cat in category_options]
     if include_returned_auto and 'Returned Automation' not in default_categories and 'Returned Automation' in category_options:
@@ -199,26 +1660,39 @@ def create_global_sidebar():
     )
     # Filter by Agent
     with st.sidebar.expander("Filter by Agent"):
-        all_agents = sorted(df["AgentName"].unique())
+        all_agents = index["options"]["AgentName"]
         selected_agents = st.multiselect("Filter by Agent", options=all_agents, default=all_agents)
-
-    # --- Efficiently apply all filters at once ---
-    day_mask = df["DayOfWeek"].isin(['Saturday', 'Sunday']) if "Weekends Only" in selected_days else df["DayOfWeek"].isin(selected_days)
-    final_mask = (
-        (df["Start Time"].dt.date >= start_date) & (df["Start Time"].dt.date <= end_date) &
-        (day_mask) &
-        (df["Shift"].isin(selected_shifts)) &
-        (df["Call Category"].isin(selected_categories)) &
-        (df["AgentName"].isin(selected_agents))
-    )
-    # Save the filtered dataframe for pages to use
-    st.session_state['df_filtered'] = df[final_mask]
+    # Route filter: calls whose Traversed path passes through the chosen queues/extensions
+    path_index = get_path_index()
+    route_nodes, route_ordered = [], True
+    if path_index is not None:
+        with st.sidebar.expander("Route contains"):
+            route_nodes = st.multiselect("Route contains", options=list(path_index["nodes"]), default=[])
+            route_ordered = st.checkbox("In this order", value=True)
+
+    # --- Resolve all filters at once through the index ---
+    selections = {
+        "DayOfWeek": ['Saturday', 'Sunday'] if "Weekends Only" in selected_days else selected_days,
+        "Shift": selected_shifts,
+        "Call Category": selected_categories,
+        "AgentName": selected_agents,
+    }
+    route = (route_nodes, route_ordered)
+    # masks and the last selection are this session's own; they reset with the dataset
+    cache = st.session_state.get('filter_cache')
+    if cache is None or cache.get("dataset") != st.session_state.get('dataset_key'):
+        cache = st.session_state['filter_cache'] = {"dataset": st.session_state.get('dataset_key')}
+    rows = filter_rows(index, start_date, end_date, selections, route, path_index, cache)
+    # Save the selected rows for pages to use (see get_filtered_df); the signature keys cached KPIs
+    st.session_state['filter_rows'] = rows
+    st.session_state['filter_signature'] = filter_signature(start_date, end_date, selections, route if path_index is not None else None)
     st.session_state['filter_selections'] = {
         "Date Range": (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')),
         "Days": selected_days,
         "Shifts": selected_shifts,
         "Categories": selected_categories,
-        "Agents": selected_agents
+        "Agents": selected_agents,
+        "Route": (" → " if route_ordered else " + ").join(route_nodes),
     }
 
 
@@ -232,11 +1706,10 @@ def create_global_sidebar():
 #if 
 
 def auto_call_hold_time_by_shift():
-    df = st.session_state.get("df_filtered")
+    df = get_filtered_df()
     if df is None or df.empty:
         return pd.DataFrame(columns=["Shift", "Average Hold Time (min)"])
-    df["Hold Time (min)"] = df["Hold Time (s)"] / 60
-    df = df.groupby("Shift")["Hold Time (min)"].mean().reset_index()
+    df = (df["Hold Time (s)"] / 60).rename("Hold Time (min)").groupby(df["Shift"], observed=True).mean().reset_index()
     df = df.rename(columns={"Hold Time (min)": "Average Hold Time (min)"})
     if df.empty:
         st.write("No data available for Hold Times by Shift.")
@@ -249,25 +1722,368 @@ def auto_call_hold_time_by_shift():
         hide_index=True
     )
 
+def service_level_curve(hold_seconds):
+    """Cumulative distribution of hold times: the distinct holds in seconds and, for each, how
+    many legs held less than it ("answered", with the total appended).
+
+    Built once (one sort) per set of legs; service_level then answers any threshold by
+    binary search.
+    """
+    seconds, counts = np.unique(np.asarray(hold_seconds), return_counts=True)
+    return {"seconds": seconds, "answered": np.concatenate([[0], np.cumsum(counts)]), "legs": int(counts.sum())}
+def service_level(curve, threshold_seconds):
+    """% of legs answered within threshold_seconds (held less than it); thresholds may be an array."""
+    answered = curve["answered"][np.searchsorted(curve["seconds"], threshold_seconds, side="left")]
+    return answered / curve["legs"] * 100 if curve["legs"] else answered * 0.0
+def answer_threshold_min():
+    """This session's "% answered within" threshold in minutes."""
+    return st.session_state.get('answer_threshold_min', ANSWER_THRESHOLD_MIN)
+def automation_wait_pct(df, threshold_min=None):
+    """% of Automation legs in df answered within the threshold, the POA "Automation Wait Time" actual."""
+    threshold_min = answer_threshold_min() if threshold_min is None else threshold_min
+    build = lambda: _automation_wait_curve(df)
+    key = filtered_view_key(df)
+    curve = build() if key is None else _dataset_memo(get_dataset(), "automation_wait", key, build)
+    if not curve["legs"]:
+        return None
+    return float(service_level(curve, threshold_min * 60))
+def _automation_wait_curve(df):
+    """Hold time service_level_curve of the Automation legs in df (empty when there are none)."""
+    automation = df["Call Category"].astype(str).str.contains("Automation", na=False).to_numpy()
+    return service_level_curve(df["Hold Time (s)"].to_numpy()[automation])
+class CallKPIs(NamedTuple):
+    """Headline metrics of a set of call legs, as computed by compute_call_kpis.
+
+    Every rate and count is per call, over the legs in the set only: a call's hold time is
+    the sum over its legs that passed the filters, not over all of its legs.
+      legs, calls            row count and unique Call IDs
+      avg_hold_min           mean hold time per call in minutes (NaN when empty)
+      service_level          cumulative distribution of call hold times (see service_level_curve)
+      pct_abandoned          % of calls with an abandoned leg
+      this_week, last_week   calls starting in the 7 days up to the latest call and the 7 before
+      wow_delta              this_week - last_week, None when last week is empty
+      top_holds              AgentName and Hold Time (s) of the top_n longest held legs
+                             (legs, so each hold is attributed to the agent it was waiting for)
+    """
+    legs: int
+    calls: int
+    avg_hold_min: float
+    service_level: dict
+    pct_abandoned: float
+    this_week: int
+    last_week: int
+    wow_delta: int | None
+    top_holds: pd.DataFrame
+def compute_call_kpis(df, top_n=TOP_HOLDS):
+    """Every headline metric of df (a CallKPIs) from one per-call aggregation of its legs."""
+    codes, call_ids = pd.factorize(df["Call ID"])
+    n_calls = len(call_ids)
+    hold = np.bincount(codes, weights=df["Hold Time (s)"].to_numpy(), minlength=n_calls)
+    abandoned = np.bincount(codes, weights=df["Abandoned"].fillna(False).to_numpy(dtype=bool), minlength=n_calls) > 0
+    curve = service_level_curve(hold)
+    kpis = {
+        "legs": len(df),
+        "calls": n_calls,
+        "avg_hold_min": hold.mean() / 60 if n_calls else float("nan"),
+        "service_level": curve,
+        "pct_abandoned": abandoned.mean() * 100 if n_calls else 0.0,
+        "this_week": 0,
+        "last_week": 0,
+        "wow_delta": None,
+        "top_holds": df.nlargest(top_n, "Hold Time (s)")[["AgentName", "Hold Time (s)"]],
+    }
+    if n_calls:
+        # a call starts with its first leg
+        start = df["Start Time"].groupby(codes, sort=False).min().to_numpy()
+        latest = start.max()
+        this_week_start = latest - np.timedelta64(6, "D")
+        last_week_start = this_week_start - np.timedelta64(7, "D")
+        this_week = int(((start >= this_week_start) & (start <= latest)).sum())
+        last_week = int(((start >= last_week_start) & (start <= this_week_start - np.timedelta64(1, "D"))).sum())
+        kpis.update(this_week=this_week, last_week=last_week, wow_delta=this_week - last_week if last_week > 0 else None)
+    return CallKPIs(**kpis)
+def get_call_kpis(df):
+    """Headline KPIs of df (see compute_call_kpis).
+
+    When df holds the session's filtered rows (see filtered_view_key) they are memoized in
+    the dataset entry under the filter signature, so every page and every widget of a
+    rerun shares one computation, as do other sessions on the same dataset with the same
+    filters. Any other frame is computed directly.
+    """
+    key = filtered_view_key(df)
+    if key is None:
+        return compute_call_kpis(df)
+    return _dataset_memo(get_dataset(), "kpis", key, lambda: compute_call_kpis(df))
+def _sweep_levels(starts, ends, groups=None):
+    """Sweep line over half-open [start, end) intervals: event times in order and the number of
+    intervals open after each event, optionally per group (returned as the third array).
+
+    Sorting the +1/-1 events is the only super-linear step. Each group's events sum to zero,
+    so one running sum over events sorted by group restarts at every group boundary.
+    """
+    keep = ends > starts
+    times = np.concatenate([starts[keep], ends[keep]])
+    deltas = np.repeat(np.array([1, -1], dtype=np.int32), keep.sum())
+    # one int64 sort key: group, then time, then ends (-1) before starts so back-to-back
+    # intervals don't overlap
+    key = (times - times.min()) * 2 + (deltas > 0) if len(times) else times
+    if groups is not None:
+        groups = np.concatenate([groups[keep], groups[keep]]).astype(np.int64)
+        key = key + groups * (int(key.max()) + 1 if len(key) else 0)
+    order = np.argsort(key)
+    return times[order], np.cumsum(deltas[order]), None if groups is None else groups[order]
+def _levels_per_minute(times, levels, first_minute, n_minutes):
+    """Highest level reached in each minute, including the level carried in from earlier minutes."""
+    peak = np.zeros(n_minutes, dtype=np.int32)
+    minutes = times // 60 - first_minute
+    if len(minutes):
+        firsts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+        peak[minutes[firsts]] = np.maximum.reduceat(levels, firsts)
+    # the level at each minute's first second, after any events at that very second
+    before = np.searchsorted(times, (first_minute + np.arange(n_minutes)) * 60, side="right") - 1
+    return np.maximum(peak, np.where(before >= 0, levels[np.maximum(before, 0)], 0))
+def _group_peaks(times, levels, groups, name):
+    """Highest level per group code and the first time it was reached (events sorted by group, then time)."""
+    firsts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else groups
+    peak = np.maximum.reduceat(levels, firsts) if len(groups) else levels
+    at_peak = np.flatnonzero(levels == np.repeat(peak, np.diff(np.r_[firsts, len(levels)])))
+    first_hit = at_peak[np.r_[True, groups[at_peak][1:] != groups[at_peak][:-1]]] if len(at_peak) else at_peak
+    return pd.DataFrame({name: peak, f"{name} Peak At": pd.to_datetime(times[first_hit], unit="s")},
+                        index=pd.Index(groups[firsts], name="group"))
+def build_concurrency(df):
+    """Calls in progress and calls waiting in queue per minute, and their peaks by queue and shift.
+
+    A call is in progress from its Start Time for its Total Duration and counts toward the
+    queue of its last leg. Each leg waits in its own queue for its Hold Time (s), starting
+    when the call's earlier legs' holds end. Returns a dict: "series" (frame of In Progress
+    and Waiting, the most of each at any moment of the minute, indexed by Minute) and "peaks"
+    (one row per queue and shift with each peak and when it first happened).
+    """
+    if df.empty:
+        return {"series": pd.DataFrame(columns=["In Progress", "Waiting"], dtype=np.int32), "peaks": pd.DataFrame()}
+    start = df["Start Time"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    call_id = df["Call ID"].to_numpy()
+    hold = df["Hold Time (s)"].to_numpy().astype(np.int64)
+    # holds run back to back in leg order within a call
+    wait_start = start + pd.Series(hold).groupby(call_id, sort=False).cumsum().to_numpy() - hold
+    last_leg = ~pd.Series(call_id).duplicated(keep="last").to_numpy()
+    call_start = start[last_leg]
+    call_end = call_start + df["Total Duration"].to_numpy().astype(np.int64)[last_leg]
+    queue_codes, queues = pd.factorize(df["Queue ID"], use_na_sentinel=False)
+    shift_codes, shifts = pd.factorize(df["Shift"], use_na_sentinel=False)
+    group = queue_codes * len(shifts) + shift_codes
+    first_minute = start.min() // 60
+    n_minutes = int(max(call_end.max(), (wait_start + hold).max()) // 60 - first_minute + 1)
+    series = pd.DataFrame({
+        "In Progress": _levels_per_minute(*_sweep_levels(call_start, call_end)[:2], first_minute, n_minutes),
+        "Waiting": _levels_per_minute(*_sweep_levels(wait_start, wait_start + hold)[:2], first_minute, n_minutes),
+    }, index=pd.to_datetime((first_minute + np.arange(n_minutes)) * 60, unit="s").rename("Minute"))
+    peaks = _group_peaks(*_sweep_levels(call_start, call_end, group[last_leg]), "In Progress").join(
+        _group_peaks(*_sweep_levels(wait_start, wait_start + hold, group), "Waiting"), how="outer")
+    peaks.insert(0, "Queue ID", np.asarray(queues, dtype=object)[peaks.index // len(shifts)])
+    peaks.insert(1, "Shift", np.asarray(shifts, dtype=object)[peaks.index % len(shifts)])
+    peaks[["In Progress", "Waiting"]] = peaks[["In Progress", "Waiting"]].fillna(0).astype(np.int32)
+    return {"series": series, "peaks": peaks.sort_values(["Queue ID", "Shift"]).reset_index(drop=True)}
+def get_concurrency(df):
+    """Concurrency of the legs in df (see build_concurrency), memoized like get_call_kpis."""
+    key = filtered_view_key(df)
+    if key is None:
+        return build_concurrency(df)
+    return _dataset_memo(get_dataset(), "concurrency", key, lambda: build_concurrency(df))
+def _erlang_a_terms(arrivals, aht, abandon_rate, threshold_s, interval_s=STAFFING_INTERVAL_MIN * 60):
+    """The per-interval inputs of _erlang_a_unanswered that don't depend on the agent count."""
+    lam = np.asarray(arrivals, dtype=float) / interval_s
+    theta = np.asarray(abandon_rate, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "lam": lam,
+            "log_lam": np.log(lam),
+            "theta": theta,
+            "aht": np.asarray(aht, dtype=float),
+            # the NegBin pmf steps by departures_m / (theta m) * (1 - exp(-theta t)); all but the departures
+            "log_step": np.log(-np.expm1(-theta * threshold_s)) - np.log(theta),
+            "threshold_s": threshold_s,
+        }
+def _erlang_a_unanswered(terms, rows, agents, erlang_b, max_queue=ERLANG_A_MAX_QUEUE, block=16):
+    """Fraction of calls not answered within the threshold in the intervals rows of terms.
+
+    agents (an int or one per row) are the agents on duty and erlang_b their Erlang B
+    blocking probability, which gives the weight of the states with free agents. The
+    waiting states are summed block columns at a time; an interval drops out once the rest
+    of its queue weight (a geometric tail past the point where departures outpace
+    arrivals) is negligible, or past max_queue waiting callers, whose calls then count as
+    unanswered.
+    """
+    lam, log_lam, theta, log_step = (terms[name][rows] for name in ("lam", "log_lam", "theta", "log_step"))
+    service = agents / terms["aht"][rows]  # completion rate with every agent busy
+    with np.errstate(divide="ignore"):
+        # log weight of the states with free agents relative to all agents busy: log(1 / B - 1)
+        log_free = np.log1p(-erlang_b) - np.log(erlang_b)
+    result = np.empty(len(rows))
+    active = np.arange(len(rows))
+    # running per-row state: last log queue weight and pmf, cdf so far, sums scaled by exp(-offset)
+    log_q = np.zeros(len(rows))
+    log_pmf = -(service + theta) * terms["threshold_s"]
+    cdf = np.zeros(len(rows))
+    offset = np.zeros(len(rows))
+    weight = np.zeros(len(rows))
+    unanswered = np.zeros(len(rows))
+    first = 0
+    while len(active):
+        m = np.arange(first, first + block)
+        s, th = service[active, None], theta[active, None]
+        log_departures = np.log(s + m * th)  # departure rate with m callers waiting (m >= 1)
+        grow = m > 0
+        block_q = log_q[active, None] + np.cumsum(np.where(grow, log_lam[active, None] - log_departures, 0), axis=1)
+        block_pmf = log_pmf[active, None] + np.cumsum(
+            np.where(grow, log_departures + log_step[active, None] - np.log(np.maximum(m, 1)), 0), axis=1)
+        block_cdf = cdf[active, None] + np.cumsum(np.exp(block_pmf), axis=1)
+        # a caller finding m waiting is answered in time with this probability (see erlang_a_service_level)
+        answered = s / (s + (m + 1) * th) * np.clip(1 - block_cdf, 0, 1)
+        new_offset = np.maximum(offset[active], block_q.max(axis=1))
+        rescale = np.exp(offset[active] - new_offset)
+        scaled = np.exp(block_q - new_offset[:, None])
+        weight[active] = weight[active] * rescale + scaled.sum(axis=1)
+        unanswered[active] = unanswered[active] * rescale + (scaled * (1 - answered)).sum(axis=1)
+        offset[active] = new_offset
+        log_q[active], log_pmf[active], cdf[active] = block_q[:, -1], block_pmf[:, -1], block_cdf[:, -1]
+        first += block
+        ratio = lam[active] / (service[active] + first * theta[active])
+        with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+            free = np.exp(log_free[active] - offset[active])
+            tail = np.where(ratio < 1, np.exp(log_q[active] - offset[active]) * ratio / (1 - ratio), np.inf)
+            done = (tail <= 1e-12 * (free + weight[active])) | (first > max_queue)
+            share = np.where(np.isinf(tail), 1.0, (unanswered[active] + tail) / (free + weight[active] + tail))
+        result[active[done]] = share[done]
+        active = active[~done]
+    return result
+def erlang_a_service_level(agents, arrivals, aht, abandon_rate, threshold_s,
+                           interval_s=STAFFING_INTERVAL_MIN * 60, max_queue=ERLANG_A_MAX_QUEUE):
+    """% of calls answered within threshold_s by agents agents in Erlang A (M/M/n+M), per interval.
+
+    agents (an int or one per interval), arrivals, aht (seconds) and abandon_rate (per
+    second of hold, > 0) are given per interval. A caller arriving with k < agents calls in
+    progress is answered at once. One finding m others waiting is answered only if the
+    m + 1 departures ahead of them (services at agents / aht, abandons at abandon_rate
+    each) all happen before they hang up themselves and within threshold_s:
+      service / (service + (m + 1) theta) * P(NegBin(service / theta + 1, exp(-theta t)) > m)
+    Callers who hang up count as unanswered. Arrivals see the stationary distribution of
+    the birth-death chain; queues longer than max_queue are counted as unanswered, so the
+    result never overstates the service level.
+    """
+    terms = _erlang_a_terms(arrivals, aht, abandon_rate, threshold_s, interval_s)
+    agents = np.broadcast_to(np.asarray(agents), terms["lam"].shape)
+    load = terms["lam"] * terms["aht"]
+    erlang_b = np.ones(len(load))
+    for n in range(1, int(agents.max(initial=0)) + 1):
+        erlang_b = np.where(n <= agents, load * erlang_b / (n + load * erlang_b), erlang_b)
+    return (1 - _erlang_a_unanswered(terms, np.arange(len(load)), agents, erlang_b, max_queue)) * 100
+def erlang_agents(arrivals, aht, target_pct, threshold_s, abandon_rate=None, interval_s=STAFFING_INTERVAL_MIN * 60):
+    """Fewest agents per interval for target_pct of calls to be answered within threshold_s.
+
+    arrivals (calls per interval) and aht (average handle time in seconds) are arrays with
+    one value per interval; all intervals are solved together, one agent count at a time,
+    with Erlang B carried from one count to the next. Without abandon_rate this is Erlang C:
+    a waiting caller's hold ends at rate (agents - load) / aht. With abandon_rate (per
+    second of hold) intervals with abandons use Erlang A (see erlang_a_service_level),
+    where callers who hang up count against the target, and the rest Erlang C.
+    """
+    arrivals = np.asarray(arrivals, dtype=float)
+    aht = np.asarray(aht, dtype=float)
+    abandon_rate = np.zeros_like(arrivals) if abandon_rate is None else np.asarray(abandon_rate, dtype=float)
+    load = arrivals * aht / interval_s  # offered load in erlangs
+    agents = np.zeros(len(load), dtype=np.int32)
+    pending = (load > 0) & (target_pct > 0)
+    erlang_b = np.ones(len(load))
+    # a 100% target is never met exactly; stop well past the largest load
+    limit = 2 * int(np.ceil(load.max(initial=0))) + 100
+    agents[pending] = limit
+    abandoning = abandon_rate > 0
+    terms = _erlang_a_terms(arrivals, aht, abandon_rate, threshold_s, interval_s) if abandoning.any() else None
+    n = 0
+    while pending.any() and n < limit:
+        n += 1
+        erlang_b = load * erlang_b / (n + load * erlang_b)
+        stable = n > load
+        with np.errstate(divide="ignore", invalid="ignore"):
+            p_wait = np.where(stable, n * erlang_b / (n - load * (1 - erlang_b)), 1.0)
+            exit_rate = np.where(aht > 0, np.maximum(n - load, 0) / aht, 0)
+        answered = (1 - p_wait * np.exp(-exit_rate * threshold_s)) * 100
+        if terms is not None:
+            answered[abandoning] = 0
+            # n agents answer at most n / load of the calls, so only counts past target_pct% of load can meet it
+            rows = np.flatnonzero(pending & abandoning & (100 * n >= target_pct * load))
+            if len(rows):
+                answered[rows] = (1 - _erlang_a_unanswered(terms, rows, n, erlang_b[rows])) * 100
+        met = pending & (answered >= target_pct)
+        agents[met] = n
+        pending &= ~met
+    return agents
+def build_staffing(df, target_pct, threshold_s):
+    """Erlang C and Erlang A agents required per STAFFING_INTERVAL_MIN interval, queue and shift.
+
+    Arrivals are the legs entering each queue in the interval. Handle time is the mean
+    Talk Time (s) of the answered legs and the abandon rate is abandons per second of hold
+    (the exponential patience estimate), both per queue and shift over the legs in df.
+    Returns a dict: "intervals" (one row per busy interval, queue and shift), "weekly"
+    (shifts of SHIFT_HOURS needed per Week Ending, Sunday–Saturday) and "by_shift" (mean and
+    peak agents per queue and shift).
+    """
+    interval = df["Start Time"].dt.floor(f"{STAFFING_INTERVAL_MIN}min").rename("Interval")
+    talk = df["Talk Time (s)"].to_numpy()
+    legs = pd.DataFrame({
+        "Talk": talk,
+        "Answered": talk > 0,
+        "Hold": df["Hold Time (s)"].to_numpy(),
+        "Abandons": df["Abandoned_Flag"].to_numpy(),
+    })
+    keys = [interval, df["Queue ID"].astype(str).rename("Queue ID"), df["Shift"].astype(str).rename("Shift")]
+    intervals = legs.groupby([k.to_numpy() for k in keys]).agg(
+        Arrivals=("Talk", "size"), Talk=("Talk", "sum"), Answered=("Answered", "sum"), Hold=("Hold", "sum"), Abandons=("Abandons", "sum"))
+    intervals.index.names = [k.name for k in keys]
+    intervals = intervals.reset_index()
+    groups = intervals.groupby(["Queue ID", "Shift"])[["Talk", "Answered", "Hold", "Abandons"]].transform("sum")
+    intervals["AHT (s)"] = (groups["Talk"] / groups["Answered"].where(groups["Answered"] > 0)).fillna(0)
+    abandon_rate = (groups["Abandons"] / groups["Hold"].where(groups["Hold"] > 0)).fillna(0).to_numpy()
+    intervals["Load (erlangs)"] = intervals["Arrivals"] * intervals["AHT (s)"] / (STAFFING_INTERVAL_MIN * 60)
+    intervals["Agents (Erlang C)"] = erlang_agents(intervals["Arrivals"], intervals["AHT (s)"], target_pct, threshold_s)
+    intervals["Agents (Erlang A)"] = erlang_agents(intervals["Arrivals"], intervals["AHT (s)"], target_pct, threshold_s, abandon_rate)
+    intervals = intervals.drop(columns=["Talk", "Answered", "Hold", "Abandons"])
+
+    day = intervals["Interval"].dt.normalize()
+    week_end = (day + pd.to_timedelta((5 - day.dt.weekday) % 7, unit="D")).rename("Week Ending")
+    hours = STAFFING_INTERVAL_MIN / 60 / SHIFT_HOURS
+    weekly = intervals.groupby(week_end)[["Agents (Erlang C)", "Agents (Erlang A)"]].sum().mul(hours)
+    weekly.columns = ["Required Shifts (Erlang C)", "Required Shifts (Erlang A)"]
+    by_shift = intervals.groupby(["Queue ID", "Shift"]).agg(
+        **{"Mean Agents (Erlang C)": ("Agents (Erlang C)", "mean"), "Peak Agents (Erlang C)": ("Agents (Erlang C)", "max"),
+           "Mean Agents (Erlang A)": ("Agents (Erlang A)", "mean"), "Peak Agents (Erlang A)": ("Agents (Erlang A)", "max")})
+    return {"intervals": intervals, "weekly": weekly.reset_index(), "by_shift": by_shift.reset_index()}
+def get_staffing(df):
+    """Staffing of the legs in df for this session's POA wait target and answer threshold.
+
+    Memoized like get_call_kpis, keyed by the filter signature, target and threshold.
+    """
+    target = float(st.session_state.get('poa_automation_wait', 90.0))
+    threshold_s = answer_threshold_min() * 60
+    build = lambda: build_staffing(df, target, threshold_s)
+    key = filtered_view_key(df)
+    if key is None:
+        return build()
+    return _dataset_memo(get_dataset(), "staffing", (key, target, threshold_s), build)
 def metric_total_calls(df):
     """Calculates total calls this week vs last week."""
     if df.empty:
         st.metric("Total Calls (This Week)", value=0, delta="0")
         return
-    latest_date = df["Start Time"].max()
-    this_week_start = latest_date - pd.Timedelta(days=6)
-    last_week_start = this_week_start - pd.Timedelta(days=7)
-    last_week_end = this_week_start - pd.Timedelta(days=1)
-    this_total = df[(df["Start Time"] >= this_week_start) & (df["Start Time"] <= latest_date)].shape[0]
-    last_total = df[(df["Start Time"] >= last_week_start) & (df["Start Time"] <= last_week_end)].shape[0]
-    delta = this_total - last_total if last_total > 0 else None
-    st.metric("Total Calls (This Week)", value=this_total, delta=delta)
+    kpis = get_call_kpis(df)
+    st.metric("Total Calls (This Week)", value=kpis.this_week, delta=kpis.wow_delta)
 def top_3_hold_times(df):
     st.write("**Top 3 Longest Hold Times (min)**")
     if df.empty or "Hold Time (s)" not in df.columns:
         st.write("No data.")
         return
-    top = df.nlargest(3, "Hold Time (s)")[["AgentName", "Hold Time (s)"]]
+    top = get_call_kpis(df).top_holds
     for _, row in top.iterrows():
         st.write(f"{row['Hold Time (s)']/60:.2f} min ({row['AgentName']})")
 def top_3_talk_times(df):
@@ -282,40 +2098,36 @@ def top_3_talk_times(df):
 def chart_calls_by_category(df):
     """Creates a pie chart of calls by category."""
     if df.empty: return None
-    counts = df['Call Category'].value_counts().reset_index()
+    cells = get_cube_cells(df)
+    if cells is not None:
+        counts = cells.groupby('Call Category', observed=True)['Legs'].sum().rename('count').sort_values(ascending=False)
+    else:
+        counts = df['Call Category'].value_counts()
+    counts = counts[counts > 0].reset_index()
     fig = px.pie(counts, names='Call Category', values='count', title='Calls by Category',
                  hole=0.4, color_discrete_sequence=UPS_COLORS)
     return fig
-def donut_hold_time_breakdown(df, title):
-    """Creates a donut chart of hold time ranges and displays a breakdown table."""
-    if df.empty:
-        return None
-    df["Hold Time (min)"] = pd.to_numeric(df["Hold Time (s)"], errors="coerce") / 60
-    bins = [0, 5, 10, 15, 30, float("inf")]
-    labels = ["0–5 min", "5–10 min", "10–15 min", "15–30 min", "30+ min"]
-    df["Hold Range"] = pd.cut(df["Hold Time (min)"], bins=bins, labels=labels, right=False)
-    breakdown = df["Hold Range"].value_counts(normalize=False, sort=False).reset_index()
-    breakdown.columns = ["Hold Time Range", "Count"]
-    total = breakdown["Count"].sum()
-    breakdown["Percent"] = (breakdown["Count"] / total * 100).round(2)
-    fig = px.pie(
-        breakdown,
-        names="Hold Time Range",
-        values="Count",
-        hole=0.4,
-        title=title,
-        color_discrete_sequence=UPS_COLORS
-    )
-    #st.plotly_chart(fig, use_container_width=True, key="hold")
-    # Hide the index (left column with 0 1 2 3 4)
-    st.dataframe(breakdown, use_container_width=True, hide_index=True, key="hold1")
-    #return fig
+def hold_time_breakdown(df, edges=HOLD_BIN_EDGES):
+    """Count and percent of calls per hold time range, without adding columns to df.
+
+    The session's filtered view is summed from the cube's per-cell histograms; any other
+    frame, or custom edges, goes through hold_histogram.
+    """
+    cells = get_cube_cells(df) if np.array_equal(edges, HOLD_BIN_EDGES) else None
+    if cells is not None:
+        counts = cells[HOLD_RANGE_LABELS].sum().to_numpy()
+    else:
+        counts = hold_histogram(df["Hold Time (s)"].to_numpy(), edges)
+    breakdown = pd.DataFrame({"Hold Time Range": hold_range_labels(edges), "Count": counts})
+    breakdown["Percent"] = (breakdown["Count"] / breakdown["Count"].sum() * 100).round(2)
+    return breakdown
 # --- 6. Layout, PDF, and UI Helper Functions ---
 def display_active_filters():
-    df_preview = st.session_state.get("df_filtered") 
+    df_preview = get_filtered_df()
 
     """Displays a summary of the currently applied global filters."""
-    if 'filter_selections' in st.session_state and st.session_state['df_original'] is not None:
+    df_original = get_original_df()
+    if 'filter_selections' in st.session_state and df_original is not None:
         selections = st.session_state['filter_selections']
         st.subheader("Active Call Filters Summary")
         date_str = f"**Date Range:** {selections['Date Range'][0]} to {selections['Date Range'][1]}"
@@ -323,36 +2135,34 @@ def display_active_filters():
         shifts_str = f"**Shifts:** {', '.join(selections['Shifts'])}"
         cat_str = f"**Categories:** {', '.join(selections['Categories'])}"
         # Check if all agents are selected for a cleaner display
-        total_agents = len(st.session_state['df_original']['AgentName'].unique())
+        total_agents = len(get_filter_index(df_original)["options"]["AgentName"])
         agent_str = f"**Agents:** All" if len(selections['Agents']) == total_agents else f"**Agents:** {len(selections['Agents'])} selected"
-        raw_rows = len(st.session_state['df_original'])
-        filtered_rows = len(st.session_state['df_filtered']) if 'df_filtered' in st.session_state else 0
+        raw_rows = len(df_original)
+        filtered_rows = len(df_preview) if df_preview is not None else 0
         rows_str = f"**Rows:** {filtered_rows} of {raw_rows} after filters applied"
-        st.markdown(f"{date_str}  \n{days_str}  \n{shifts_str}  \n{cat_str}  \n{agent_str}  \n{rows_str}")
+        route_str = f"**Route contains:** {selections['Route']}  \n" if selections.get('Route') else ""
+        st.markdown(f"{date_str}  \n{days_str}  \n{shifts_str}  \n{cat_str}  \n{agent_str}  \n{route_str}{rows_str}")
         with st.expander("Preview Table"):
             st.dataframe(df_preview)   
 def load_digium_kpi(df):
     if df.empty:
         st.info("No data available for the selected filters.")
         return
+    kpis = get_call_kpis(df)
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     with kpi1:
         st.metric(
             label="Total Calls",
-            value=len(df), #old was ['Call ID'].nunique(),
+            value=kpis.calls,
             help="Total Unique Call IDs"
         )
     with kpi2:
-        avg_hold_time_min = pd.to_numeric(df['Hold Time (s)'], errors='coerce').mean() / 60
-        st.metric("Average Hold Time (min)", f"{avg_hold_time_min:.2f}")
+        st.metric("Average Hold Time (min)", f"{kpis.avg_hold_min:.2f}")
     with kpi3:
-        answered_under_5min = pd.to_numeric(df['Hold Time (s)'], errors='coerce') < 300
-        percent_answered = (answered_under_5min.sum() / len(df)) * 100 if len(df) > 0 else 0
-        st.metric("% Answered < 5 min", f"{percent_answered:.2f}%")
+        threshold = answer_threshold_min()
+        st.metric(f"% Answered < {threshold:g} min", f"{float(service_level(kpis.service_level, threshold * 60)):.2f}%")
     with kpi4:
-        abandoned_mask = df['Abandoned'].astype(str).str.strip().str.lower() == "true"
-        percent_abandoned = (abandoned_mask.sum() / len(df)) * 100 if len(df) > 0 else 0
-        st.metric("% Abandoned", f"{percent_abandoned:.2f}%")
+        st.metric("% Abandoned", f"{kpis.pct_abandoned:.2f}%")
 
 def hold_top3_shift(df):
     c1, c2 = st.columns(2)
@@ -373,26 +2183,13 @@ def _sanitize_key(s: str) -> str:
     key = "".join(ch for ch in key if ch in allowed)
     return key[:30]  # cap length to avoid overly long keys
 
-def donut_hold_time_breakdown(df, title, key_suffix: str | None = None):
+def donut_hold_time_breakdown(df, title, key_suffix: str | None = None, edges=HOLD_BIN_EDGES):
     """Creates a donut chart of hold time ranges and displays a breakdown table."""
     if df.empty:
         st.write("No data available.")
         return None
 
-    df["Hold Time (min)"] = pd.to_numeric(df["Hold Time (s)"], errors="coerce") / 60
-    bins = [0, 5, 10, 15, 30, float("inf")]
-    labels = ["0–5 min", "5–10 min", "10–15 min", "15–30 min", "30+ min"]
-    df["Hold Range"] = pd.cut(
-        df["Hold Time (min)"], bins=bins, labels=labels, right=False
-    )
-    breakdown = (
-        df["Hold Range"]
-        .value_counts(normalize=False, sort=False)
-        .reset_index()
-    )
-    breakdown.columns = ["Hold Time Range", "Count"]
-    total = breakdown["Count"].sum()
-    breakdown["Percent"] = (breakdown["Count"] / total * 100).round(2)
+    breakdown = hold_time_breakdown(df, edges)
 
     fig1 = px.pie(
         breakdown,
@@ -418,7 +2215,7 @@ def top_3_hold_times(df):
     if df.empty or "Hold Time (s)" not in df.columns:
         st.write("No data.")
         return
-    top = df.nlargest(3, "Hold Time (s)")[["AgentName", "Hold Time (s)"]]
+    top = get_call_kpis(df).top_holds
     for _, row in top.iterrows():
         st.write(f"{row['Hold Time (s)']/60:.2f} min ({row['AgentName']})")
 def top_3_talk_times(df):
@@ -428,9 +2225,8 @@ def top_3_talk_times(df):
         st.write("No data.")
         return
     # Calculate total call time for each row
-    df = df.copy()
-    df["Total Call Time (s)"] = df["Hold Time (s)"] + df["Talk Time (s)"]
-    top = df.nlargest(3, "Total Call Time (s)")[["AgentName", "Total Call Time (s)"]]
+    total = (df["Hold Time (s)"] + df["Talk Time (s)"]).rename("Total Call Time (s)")
+    top = pd.concat([df["AgentName"], total], axis=1).nlargest(3, "Total Call Time (s)")
     for _, row in top.iterrows():
         st.write(f"{row['Total Call Time (s)']/60:.2f} min ({row['AgentName']})")
 def dwayne_YTD_avg_hold():
@@ -743,9 +2539,22 @@ def auto_percent_resolved(df):
 
 def shifts(df):
     st.info("(Teams) Automation Support - Number of Shifts Week Ending Bar Chart")
-    st.write(f"Actual Staff: {st.session_state.actual_staff_for_week}")
-    st.warning("Need SQL database for historical data")
-    st.image("images/teams1.png")
+    actual_staff = st.session_state.get('actual_staff_for_week', 70)
+    st.write(f"Actual Staff: {actual_staff}")
+    staffing = None if df is None or df.empty else get_staffing(df)
+    if staffing is None or staffing["weekly"].empty:
+        st.warning("Upload call data on the Home page to estimate required staffing.")
+        return
+    weekly = staffing["weekly"].assign(WE=staffing["weekly"]["Week Ending"].dt.strftime("WE %m/%d"))
+    fig = px.bar(weekly, x="WE", y=["Required Shifts (Erlang C)", "Required Shifts (Erlang A)"], barmode="group",
+                 title=f"Shifts Needed for {st.session_state.get('poa_automation_wait', 90.0):g}% Answered "
+                       f"Within {answer_threshold_min():g} min",
+                 labels={"value": "Shifts", "variable": "", "WE": "Week Ending"},
+                 color_discrete_sequence=UPS_COLORS)
+    fig.add_hline(y=actual_staff, line_dash="dash", line_color=UPS_COLORS[2], annotation_text="Entered shifts")
+    st.plotly_chart(fig, use_container_width=True)
+    st.write("**Agents needed per 15 minutes, by queue and shift**")
+    st.dataframe(staffing["by_shift"].round(2), use_container_width=True, hide_index=True)
 
 def poa_table(df):
     # Access POA values from session state
@@ -756,6 +2565,10 @@ def poa_table(df):
     poa_automation_wait = st.session_state.get('poa_automation_wait', 90.0)
     poa_conventional_mttr = st.session_state.get('poa_conventional_mttr', 2.0)
     poa_automation_mttr = st.session_state.get('poa_automation_mttr', 1.0)
+    # measured from the loaded calls when there are Automation calls, else the entered value
+    actual_automation_wait = automation_wait_pct(df)
+    if actual_automation_wait is None:
+        actual_automation_wait = st.session_state.actual_automation_wait
 
     poa_data = {
         "Conventional Defects (%)": poa_conventional_defects,
@@ -788,13 +2601,13 @@ def poa_table(df):
         ],
         "Quarterly Average": [
             f" {int(round(st.session_state.actual_auto_defects))}%",
-            f"{int(round(st.session_state.actual_automation_wait))}%",
+            f"{int(round(actual_automation_wait))}%",
             f"{int(round(st.session_state.actual_mttr))} Hrs",
         ],
 
         "Met": [
             "Yes" if st.session_state.actual_auto_defects <= poa_tsg_defects else "No",
-            "Yes" if st.session_state.actual_automation_wait >= poa_automation_wait else "No",
+            "Yes" if actual_automation_wait >= poa_automation_wait else "No",
             "Yes" if st.session_state.actual_mttr <= poa_automation_mttr else "No",
         ]
     }
@@ -860,38 +2673,108 @@ def donut_all_lines_holds():
 
 
 # --- 5. Charting Functions  ---
+def _sankey_edges(edges, limit=TRANSFER_SANKEY_EDGES):
+    """The limit heaviest hops of edges (sorted heaviest first) a Sankey can draw, whose links
+    must flow one way.
+
+    Self-loops are dropped, as is any hop that would close a cycle with the hops kept so far.
+    """
+    reach = {}  # node -> nodes reachable from it through the kept hops
+    kept = []
+    for i, source, target in zip(edges.index, edges["Source"], edges["Target"]):
+        if len(kept) == limit:
+            break
+        if source == target or source in reach.get(target, ()):
+            continue
+        kept.append(i)
+        downstream = reach.get(target, set()) | {target}
+        reach.setdefault(source, set())
+        for node, reachable in list(reach.items()):
+            if node == source or source in reachable:
+                reach[node] = reachable | downstream
+    return edges.loc[kept]
+def transfer_flow():
+    """Operations Sankey of how the filtered calls move between queues and extensions.
+
+    The TRANSFER_SANKEY_EDGES busiest hops are drawn, except repeats of the same node
+    (e.g. a call re-entering its queue) and hops that would close a loop, which a Sankey
+    cannot show; both still count in the path and hold tables beside it.
+    """
+    df = get_filtered_df()
+    if df is None or df.empty or "Traversed" not in df.columns:
+        st.info("No data available or 'Traversed' column missing.")
+        return
+    graph = get_transfer_graph(df)
+    edges = _sankey_edges(graph["edges"])
+    if edges.empty:
+        st.write("No transfers between queues or extensions in the selected calls.")
+        return
+    labels = pd.Index(pd.unique(np.concatenate([edges["Source"], edges["Target"]])))
+    fig = go.Figure(go.Sankey(
+        node=dict(label=list(labels), color=UPS_COLORS[0], pad=12),
+        link=dict(
+            source=labels.get_indexer(edges["Source"]),
+            target=labels.get_indexer(edges["Target"]),
+            value=edges["Transfers"],
+            customdata=edges["Avg Hold (s)"] / 60,
+            hovertemplate="%{source.label} → %{target.label}<br>%{value} transfers<br>Avg hold %{customdata:.2f} min<extra></extra>",
+        ),
+    ))
+    fig.update_layout(title=f"Call Flow (top {len(edges)} hops)")
+    st.plotly_chart(fig, use_container_width=True)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.write(f"**Top {len(graph['paths'])} Paths**")
+        st.dataframe(graph["paths"].round(2), use_container_width=True, hide_index=True)
+    with c2:
+        st.write("**Hops Adding the Most Hold Time**")
+        st.dataframe(graph["edges"].sort_values("Hold (s)", ascending=False).head(TRANSFER_TOP_PATHS).round(2),
+                     use_container_width=True, hide_index=True)
+def repeat_callers():
+    """Operations view of callers who call again, over the filtered calls only.
+
+    Shows the % of calls made within each REPEAT_WINDOWS window of the same number's
+    previous call, the % of abandoned calls called back, and both rates by queue and by
+    call category (see get_repeat_calls).
+    """
+    df = get_filtered_df()
+    if df is None or df.empty:
+        st.info("No data available for the selected filters.")
+        return
+    repeats = get_repeat_calls(df)
+    cols = st.columns(len(REPEAT_WINDOWS) + 1)
+    for col, label in zip(cols, REPEAT_WINDOWS):
+        col.metric(f"Repeat Calls Within {label}", f"{repeats[f'Repeat ({label})'].mean() * 100:.2f}%")
+    abandoned = get_call_table(df)
+    abandoned = abandoned.loc[abandoned["Abandoned"].fillna(False).to_numpy(), "Call ID"]
+    called_back = repeats.loc[repeats["Call ID"].isin(abandoned).to_numpy(), f"Called Back ({list(REPEAT_WINDOWS)[-1]})"]
+    cols[-1].metric(f"Abandoned Calls Called Back Within {list(REPEAT_WINDOWS)[-1]}",
+                    f"{called_back.mean() * 100:.2f}%" if len(called_back) else "N/A")
+    c1, c2 = st.columns(2)
+    with c1:
+        st.write("**Repeat Rate by Queue**")
+        st.dataframe(repeat_rates(df, repeats, "Queue ID").round(2), use_container_width=True, hide_index=True)
+    with c2:
+        st.write("**Repeat Rate by Call Category**")
+        st.dataframe(repeat_rates(df, repeats, "Call Category").round(2), use_container_width=True, hide_index=True)
 def gt_2_traverse():
-    df = st.session_state.get("df_filtered")
+    df = get_filtered_df()
     if df is None or df.empty or "Traversed" not in df.columns:
         st.info("No data available or 'Traversed' column missing.")
         return
 
-    def semicolon_count_exclude_999(traversed):
-        if pd.isna(traversed) or "queue" not in str(traversed).lower():
-            return 0
-        queues = [q.strip() for q in str(traversed).split(";") if "queue" in q.lower()]
-        queues_ex_999 = [q for q in queues if "999" not in q]
-        return len(queues_ex_999) - 1 if len(queues_ex_999) > 1 else 0
-
-    def list_queues_exclude_999(traversed):
-        if pd.isna(traversed) or "queue" not in str(traversed).lower():
-            return ""
-        return ", ".join([
-            q.strip() for q in str(traversed).split(";")
-            if q.strip() and "queue" in q.lower() and "999" not in q
-        ])
-
-    df = df.copy()
-    df["Semicolon Count Excl 999"] = df["Traversed"].apply(semicolon_count_exclude_999)
-
-    # Aggregate by Call ID: sum hold/talk times, max semicolon count, concatenate queues, get first Start Time
-    agg_df = df.groupby("Call ID").agg({
-        "Hold Time (s)": "sum",
-        "Talk Duration": "sum",
-        "Semicolon Count Excl 999": "max",
-        "Traversed": lambda x: ";".join([str(i) for i in x if pd.notna(i)]),
-        "Start Time": "min"
-    }).reset_index()
+    # Queue paths come from the segment table parsed at upload
+    entry = get_dataset()
+    segments = None if entry is None else entry.get("segments")
+    if segments is None:
+        segments = build_segment_table(df)
+    segments = segments[segments["Call ID"].isin(df["Call ID"].unique()).to_numpy()]
+    queue_segments = segments[(segments["Kind"] == "Queue").to_numpy() & (segments["Node"] != "999").to_numpy()]
+
+    agg_df = get_call_table(df)[["Call ID", "Hold Time (s)", "Talk Duration", "Start Time"]].reset_index(drop=True)
+    # One queue is no transfer, so n queues (excluding 999) count as n - 1
+    queue_count = agg_df["Call ID"].map(queue_segments.groupby("Call ID").size()).fillna(0).astype(int)
+    agg_df["Semicolon Count Excl 999"] = np.where(queue_count > 1, queue_count - 1, 0)
 
     # Only keep calls with 2 or more queues traversed (excluding 999)
     df_gt2 = agg_df[agg_df["Semicolon Count Excl 999"] >= 2].copy()
@@ -903,7 +2786,10 @@ def gt_2_traverse():
             st.write("No unique calls traversed 2 or more queues (excluding 999).")
             return
 
-        df_gt2["Queues Traversed"] = df_gt2["Traversed"].apply(list_queues_exclude_999)
+        gt2_queues = queue_segments[queue_segments["Call ID"].isin(df_gt2["Call ID"]).to_numpy()]
+        df_gt2["Queues Traversed"] = df_gt2["Call ID"].map(
+            gt2_queues["Node"].astype(str).groupby(gt2_queues["Call ID"]).agg(", ".join)
+        )
         df_gt2["Total Call Time (min)"] = (
             pd.to_numeric(df_gt2.get("Hold Time (s)", 0), errors="coerce").fillna(0) +
             pd.to_numeric(df_gt2.get("Talk Duration", 0), errors="coerce").fillna(0)
@@ -1026,23 +2912,28 @@ def gt_2_traverse():
         st.plotly_chart(fig_hold_time, use_container_width=True)
 def calls_by_day_bar():
     #sAverage number of calls by day selected (using global date range filter)
-    df = st.session_state.get("df_filtered")
+    df = get_filtered_df()
     if df is None or df.empty:
         st.write("No data available for the selected filters.")
         return
 
     # Use the date range from the global filter selections
     filter_selections = st.session_state.get("filter_selections", {})
+    cells = get_cube_cells(df)
     if "Date Range" in filter_selections:
         start_date_str, end_date_str = filter_selections["Date Range"]
         start_date = pd.to_datetime(start_date_str)
         end_date = pd.to_datetime(end_date_str)
-        df = df[(df["Start Time"].dt.date >= start_date.date()) & (df["Start Time"].dt.date <= end_date.date())]
+        if cells is not None:
+            cells = cells[cells["Date"].between(start_date.normalize(), end_date.normalize())]
+        else:
+            df = df[(df["Start Time"].dt.date >= start_date.date()) & (df["Start Time"].dt.date <= end_date.date())]
 
-    df["DayOfWeek"] = pd.Categorical(df["DayOfWeek"], categories=[
-        "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"
-    ], ordered=True)
-    calls_by_day = df.groupby("DayOfWeek").size().reset_index(name='Call Count')
+    if cells is not None:
+        counts = cells.groupby(pd.Categorical(cells["DayOfWeek"], categories=WEEKDAYS, ordered=True), observed=False)["Legs"].sum()
+    else:
+        counts = df.groupby(pd.Categorical(df["DayOfWeek"], categories=WEEKDAYS, ordered=True), observed=False).size()
+    calls_by_day = counts.rename_axis("DayOfWeek").reset_index(name='Call Count')
     fig = px.bar(
         calls_by_day,
         x='DayOfWeek',
@@ -1056,10 +2947,82 @@ def calls_by_day_bar():
 def chart_calls_by_category(df):
     """Creates a pie chart of calls by category."""
     if df.empty: return None
-    counts = df['Call Category'].value_counts().reset_index()
+    cells = get_cube_cells(df)
+    if cells is not None:
+        counts = cells.groupby('Call Category', observed=True)['Legs'].sum().rename('count').sort_values(ascending=False)
+    else:
+        counts = df['Call Category'].value_counts()
+    counts = counts[counts > 0].reset_index()
     fig = px.pie(counts, names='Call Category', values='count', title='Calls by Category',
                  hole=0.4, color_discrete_sequence=UPS_COLORS)
     return fig
+def ytd_sketch_summary(queues=None):
+    """Weekly sketch summary since January 1st of the latest sketched year, or None without sketches."""
+    sketches = get_sketch_store()
+    if sketches is None or sketches["keys"].empty:
+        return None
+    year_start = pd.Timestamp(year=sketches["keys"]["Date"].max().year, month=1, day=1)
+    return weekly_sketch_summary(sketches, start=year_start, queues=queues)
+def chart_ytd_hold_percentiles(summary):
+    """Weekly p50 / p90 / p99 hold time lines from the persisted sketches."""
+    if summary is None or summary.empty:
+        return None
+    columns = [col for col in summary.columns if col.endswith("Hold (min)")]
+    fig = px.line(summary, x="Week Ending", y=columns, markers=True,
+                  title=f"YTD Hold Time Percentiles per Week (±{SKETCH_RELATIVE_ACCURACY:.0%})",
+                  labels={"value": "Hold Time (min)", "variable": ""},
+                  color_discrete_sequence=UPS_COLORS)
+    return fig
+def chart_ytd_unique_callers(summary):
+    """Weekly distinct callers and calls from the persisted HyperLogLog sketches."""
+    if summary is None or summary.empty:
+        return None
+    error = 1.04 / np.sqrt(1 << HLL_PRECISION)
+    fig = px.line(summary, x="Week Ending", y=["Unique Callers", "Unique Calls"], markers=True,
+                  title=f"YTD Unique Callers and Calls per Week (±{error:.1%})",
+                  labels={"value": "Count", "variable": ""},
+                  color_discrete_sequence=UPS_COLORS)
+    return fig
+def concurrent_calls():
+    """Operations chart of peak calls in progress and waiting among the filtered legs, with the peak table."""
+    df = get_filtered_df()
+    if df is None or df.empty:
+        st.write("No data available for concurrent calls.")
+        return None
+    concurrency = get_concurrency(df)
+    series = concurrency["series"]
+    # per-minute peaks over long ranges are resampled to their interval peaks to keep the chart light
+    days = (series.index[-1] - series.index[0]).days
+    freq = "min" if days <= 2 else "15min" if days <= 31 else "h"
+    plot = series.resample(freq).max().reset_index()
+    fig = px.line(plot, x="Minute", y=["In Progress", "Waiting"], title="Concurrent Calls (peak per interval)",
+                  labels={"value": "Calls", "variable": "", "Minute": ""}, color_discrete_sequence=UPS_COLORS)
+    st.plotly_chart(fig, use_container_width=True)
+    st.write("**Peak concurrency by queue and shift (filtered calls)**")
+    st.dataframe(concurrency["peaks"], use_container_width=True, hide_index=True)
+    return fig
+def chart_service_level_curve(curve, threshold_min=None, max_min=60):
+    """% answered within T for every T up to max_min minutes, marking the current threshold."""
+    if curve is None or not curve["legs"]:
+        return None
+    threshold_min = answer_threshold_min() if threshold_min is None else threshold_min
+    minutes = np.arange(0, max_min + 0.5, 0.5)
+    levels = pd.DataFrame({"Threshold (min)": minutes, "% Answered": service_level(curve, minutes * 60)})
+    fig = px.line(levels, x="Threshold (min)", y="% Answered", title="Service Level: % Answered Within Threshold",
+                  color_discrete_sequence=UPS_COLORS)
+    fig.add_vline(x=threshold_min, line_dash="dash", line_color=UPS_COLORS[1],
+                  annotation_text=f"{float(service_level(curve, threshold_min * 60)):.1f}% < {threshold_min:g} min")
+    fig.update_yaxes(range=[0, 100])
+    return fig
+def chart_weekly_call_volume(rollups):
+    """Bar chart of calls per week ending, read from the incrementally maintained rollups."""
+    if not rollups or rollups["weekly"].empty:
+        return None
+    weekly = rollups["weekly"].rename("Call Count").reset_index()
+    weekly["WE"] = weekly["Week Ending"].dt.strftime("WE %m/%d")
+    fig = px.bar(weekly, x="WE", y="Call Count", title="Calls per Week Ending",
+                 color_discrete_sequence=UPS_COLORS)
+    return fig
 def generate_performance_pdf(kpi_data, charts):
     """Generates a PDF report from performance data and charts."""
     try: